@@ -12,9 +12,10 @@ def cythonit(pyxfile, html=False):
 
 def compileit(cfile, outputfile):
     import os
+    from distutils.sysconfig import get_python_inc
     os.system('gcc -shared -pthread -fPIC -fwrapv -O2 -Wall\
-    -fno-strict-aliasing -I/usr/include/python2.6 -o ' + outputfile + ' ' +\
-    cfile)
+    -fno-strict-aliasing -I' + get_python_inc() + ' -I' + np.get_include() +\
+    ' -o ' + outputfile + ' ' + cfile)
 
 def generate_kf_module():
     # Lean, Pitch, Steer
@@ -12,12 +12,10 @@ params = [m, g, r]
 
 def plot_energy(t, x):
     # Plot the kinetic energy, potential energy, and total energy
-    ke = zeros((n,1))
-    pe = zeros((n,1))
-    te = zeros((n,1))
-    for i in range(n):
-        ke[i], pe[i] = rd.energy(x[i,:], params)
-        te[i] = ke[i] + pe[i]
+    e = rd.energy(x, params)
+    ke = e[:, 0]
+    pe = e[:, 1]
+    te = ke + pe
 
     plt.figure()
     plt.plot(t, ke, label='KE')
@@ -226,9 +226,13 @@ Kinetic and Potential Energy of rolling disc.
          g:  Gravitational constant
          r:  Radius of disc
 
-    Returns a list/array of kinetic energy and potential energy, respectively.
+    _x may also be an array of shape (n, 8), in which case an array of shape
+    (n, 2) is returned.
+
+    Returns an array of kinetic energy and potential energy, respectively.
 """
-output_string += generate_function("energy", energy_eqs, q+u, params, docstring=ds)
+output_string += generate_function("energy", energy_eqs, q+u, params, docstring=ds,
+        vectorized=True)
 
 file = open('rollingdisc_lib.py', 'w')
 file.write(output_string)
@@ -171,22 +171,31 @@ def energy(_x, _params):
          g:  Gravitational constant
          r:  Radius of disc
 
-    Returns a list/array of kinetic energy and potential energy, respectively.
+    _x may also be an array of shape (n, 8), in which case an array of shape
+    (n, 2) is returned.
+
+    Returns an array of kinetic energy and potential energy, respectively.
 
     """
+    from numpy import asarray, empty, shape
+    from numpy import absolute as Abs, arccos as acos, arcsin as asin, arctan as atan, arctan2 as atan2, cos, cosh, exp, log, sign, sin, sinh, sqrt, tan, tanh
+
     # Unpack function arguments
-    q1, q2, q3, q4, q5, u1, u2, u3 = _x
+    q1, q2, q3, q4, q5, u1, u2, u3, = asarray(_x).T
 
     # Unpack function parameters
-    m, g, r = _params
+    m, g, r, = _params
 
     # Trigonometric functions
     c2 = cos(q2)
 
     # Calculate return values
-    ke = 0.125*m*r**2*u3**2 + 0.75*m*r**2*u2**2 + 0.625*m*r**2*u1**2
-    pe = -g*m*r + g*m*r*c2
+    ke = 0.625*m*r**2*u1**2 + 0.75*m*r**2*u2**2 + 0.125*m*r**2*u3**2
+    pe = g*m*r*c2 - g*m*r
 
     # Return calculated values
-    return [ke, pe]
+    _out = empty(shape(_x)[:-1] + (2,))
+    _out[..., 0] = ke
+    _out[..., 1] = pe
+    return _out
 
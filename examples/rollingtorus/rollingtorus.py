@@ -67,10 +67,10 @@ eq1 = dot(vcon1 - vcon2, N[1])
 eq2 = dot(vcon1 - vcon2, N[2])
 
 # eq1 and eq2 are linear in the time derivatives of the coordinates, determine
-# the matrix of coefficients here.
+# the matrix of coefficients here, and solve them for the contact point rates
+# by sparse elimination.
 T = coefficient_matrix([eq1, eq2], qd)
-Td_inv, Ti = transform_matrix(T, qd, qd[3:])
-contact_rates = Td_inv*Ti*Matrix(qd[:3])
+contact_rates = transform_matrix(T, qd, qd[3:], method='sparse')*Matrix(qd[:3])
 
 # Append the contact point kinematic differential equations to the list,
 # keeping them in implicit form.
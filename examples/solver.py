@@ -1,36 +1,24 @@
-from numpy import array, empty
+from numpy import array
+from pydy.integrators import rk4
 
-def rk4_step(x, y, h, derivs):
+def rk4int(derivs, y0, t, h=None):
     """
-    Does one Runge-Kutta 4th order step.
+    Solves the set of ODEs using rk4, taking one step between successive
+    times of t; the result at t[0] is y0.  h is ignored, the step sizes come
+    from t.
 
-    Use rk4int() to solve the equations on the whole interval.
-    """
-    k1 = h * derivs(y, x)
-    k2 = h * derivs(y + k1/2, x + h/2)
-    k3 = h * derivs(y + k2/2, x + h/2)
-    k4 = h * derivs(y + k3, x + h)
-    return y + k1/6 + k2/3 + k3/3 + k4/6
-
-def rk4int(derivs, y0, t, h=0.1):
-    """
-    Solves the set of linear ODEs using rk4.
+    Use pydy.integrators directly for the adaptive rk45 and the symplectic
+    Euler methods, and to integrate many initial conditions at once.
 
     Example:
     >>> t = arange(0, 7.e-5, h)
-    >>> sol = rk4int(derivs, t, (a0, b0, c0))
+    >>> sol = rk4int(derivs, (a0, b0, c0), t)
     >>> from pylab import plot, show, legend
     >>> plot(t, sol[:, 0], ".", label="y_1")
     >>> plot(t, sol[:, 1], ".", label="y_2")
     >>> plot(t, sol[:, 2], ".", label="y_3")
     """
-    y = array(y0)
-
-    result = empty((len(t), len(y)))
-    for i, x in enumerate(t):
-        y = rk4_step(x, y, h, derivs)
-        result[i, :] = y
-    return result
+    return rk4(derivs, y0, t)
 
 if __name__ == "__main__":
     # simple example from chemical kinetics:
@@ -5,3 +5,87 @@ e3 = Matrix([0, 0, 1])
 zero = Matrix([0, 0, 0])
 t = Symbol("t")
 
+
+class LRUCache(object):
+    """A dictionary-like cache holding at most maxsize entries.
+
+    When full, storing a new key evicts the least recently used one.  The
+    number of lookups that found their key (hits) and that did not (misses)
+    is counted.
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        """Removes all entries; the hit and miss counts are kept."""
+        # Each link is [previous link, next link, key, value]; root is the
+        # sentinel of a circular doubly linked list, most recent last.
+        self.root = root = []
+        root[:] = [root, root, None, None]
+        self.links = {}
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def get(self, key, default=None):
+        """Returns the value stored for key, marking it as most recently used,
+        or default if key is not stored.
+        """
+        link = self.links.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+        last = self.root[0]
+        last[1] = self.root[0] = link
+        link[0] = last
+        link[1] = self.root
+        return link[3]
+
+    def __setitem__(self, key, value):
+        if key in self.links:
+            self.links[key][3] = value
+            return
+        if self.maxsize <= 0:
+            return
+        if len(self.links) >= self.maxsize:
+            oldest = self.root[1]
+            self.root[1] = oldest[1]
+            oldest[1][0] = self.root
+            del self.links[oldest[2]]
+        last = self.root[0]
+        link = [last, self.root, key, value]
+        last[1] = self.root[0] = link
+        self.links[key] = link
+
+    def resize(self, maxsize):
+        """Changes the maximum number of entries, evicting the least recently
+        used ones if there are now too many.
+        """
+        self.maxsize = maxsize
+        while len(self.links) > max(maxsize, 0):
+            oldest = self.root[1]
+            self.root[1] = oldest[1]
+            oldest[1][0] = self.root
+            del self.links[oldest[2]]
+
+    def info(self):
+        """Returns a dictionary with the hits, misses, hit rate, current size
+        and maximum size of the cache.
+        """
+        lookups = self.hits + self.misses
+        if lookups:
+            rate = float(self.hits)/lookups
+        else:
+            rate = 0.0
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': rate,
+                'size': len(self.links), 'maxsize': self.maxsize}
@@ -1,8 +1,20 @@
-from sympy import (Symbol, zeros, Eq, Derivative, Function, sin, cos, tan, S,
-        Eq, simplify)
+from sympy import (Symbol, Dummy, zeros, Eq, Derivative, Function, sin, cos,
+        tan, S, Eq, simplify, Add, Mul, Pow, Matrix, count_ops,
+        numbered_symbols)
+from sympy import cse as sympy_cse
+from sympy.printing import ccode
+from distutils.ccompiler import new_compiler
+from distutils.sysconfig import customize_compiler
+from hashlib import sha1
+import ctypes
+import imp
+import os
+import re
+import shutil
+import tempfile
 
 from pydy import UnitVector, Vector, ReferenceFrame, Point, Dyad, Inertia
-from common import e1, e2, e3, zero, t
+from common import e1, e2, e3, zero, t, LRUCache
 
 def unicode_subscript(num):
     """Converts an integer to the unicode subscript representation of that
@@ -39,9 +51,8 @@ def ppuv(e):
     three = "\xe2\x82\x83"
     bold = "\033[1m"
     reset = "\033[0;0m"
-    s = str(e.v['sym'])
-    name = s[:-1]
-    index = s[-1]
+    name = e.frame.name.lower()
+    index = str(e.i)
     r = "%s%s" % (bold, name)
     if index == "1":
         r += one
@@ -55,12 +66,92 @@ def ppuv(e):
 def sort_UnitVector(a, b):
     """Sort UnitVector objects by how many rotations their reference frame is away from
     the Newtonian frame.
+
+    UnitVectors of frames at the same depth are ordered by frame creation,
+    then by axis.
     """
-    if a.frame == b.frame:
-        return (a.i > b.i) - (a.i < b.i)
+    da = len(a.frame.ref_frame_list)
+    db = len(b.frame.ref_frame_list)
+    if da == db:
+        return (a.key > b.key) - (a.key < b.key)
     else:
-        return (len(a.frame.ref_frame_list) > len(b.frame.ref_frame_list)) -\
-            (len(a.frame.ref_frame_list) < len(b.frame.ref_frame_list))
+        return (da > db) - (da < db)
+
+def tree_path(a_list, b_list):
+    """Returns the path between two nodes of a tree as a tuple, including
+    both end nodes.
+
+    a_list and b_list are the ancestor lists of the two nodes, starting with
+    the node itself and ending with the root of the tree, i.e., the
+    ref_frame_list attribute of a ReferenceFrame or the point_list attribute
+    of a Point.  Because these lists hold every ancestor, the ancestor at any
+    depth is found by indexing, and the depth of the lowest common ancestor
+    is found by a binary search in O(log(depth)) comparisons.
+    """
+    la = len(a_list)
+    lb = len(b_list)
+    # Ancestors at depth d (the root has depth 0) are a_list[la - 1 - d] and
+    # b_list[lb - 1 - d].  Once they agree they agree for all smaller d.
+    lo, hi = 0, min(la, lb) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a_list[la - 1 - mid] is b_list[lb - 1 - mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    up = a_list[:la - lo]
+    down = b_list[:lb - 1 - lo]
+    return tuple(up) + tuple(reversed(down))
+
+def monomial_coefficients(expr, atoms):
+    """Returns a dictionary mapping each monomial in the elements of atoms that
+    appears in expr to its coefficient.
+
+    Each term of expr (it is not expanded) is visited once: the factors which
+    are elements of atoms, or powers of them, form the monomial of the term,
+    the remaining factors its coefficient.  Terms free of atoms are left out.
+
+    >>> from sympy import symbols
+    >>> a, b, x, y = symbols('a b x y')
+    >>> c = monomial_coefficients(a*x + b*x + a*b*x*y + 3, set([x, y]))
+    >>> c == {x: a + b, x*y: a*b}
+    True
+    """
+    coefs = {}
+    for term in Add.make_args(expr):
+        monomial = []
+        coef = []
+        for f in Mul.make_args(term):
+            if (f.base if f.is_Pow else f) in atoms:
+                monomial.append(f)
+            else:
+                coef.append(f)
+        if monomial:
+            coefs.setdefault(Mul(*monomial), []).append(Mul(*coef))
+    for monomial, c in coefs.items():
+        coefs[monomial] = Add(*c)
+    return coefs
+
+def linear_coefficients(expr, linear_terms):
+    """Returns the coefficients in expr of each of linear_terms, as a list.
+
+    linear_terms may be symbols, functions, derivatives, or products and
+    powers of these, e.g. [u1, u2, u1*u2, u1**2].  The monomials of expr are
+    found with monomial_coefficients(), using every quantity appearing in
+    linear_terms; monomials not in linear_terms are ignored, and a linear
+    term which does not appear gets S(0).
+
+    >>> from sympy import symbols
+    >>> a, b, x, y = symbols('a b x y')
+    >>> linear_coefficients(a*x + b*x + a*b*x*y + 3, [x, y, x*y])
+    [a + b, 0, a*b]
+    """
+    atoms = set([])
+    for term in linear_terms:
+        for f in Mul.make_args(term):
+            atoms.add(f.base if f.is_Pow else f)
+    coefs = monomial_coefficients(expr, atoms)
+    return [coefs.get(term, S(0)) for term in linear_terms]
 
 def coefficient_matrix(eqns, linear_terms):
     """Given a list of equations linear in some specified terms, form the
@@ -78,8 +169,107 @@ def coefficient_matrix(eqns, linear_terms):
                 B[i, j] = B_ij
     return B
 
+# Imports preceding the source executed by exec_source(): the functions of
+# the math module which generated code can call, under their printed names
+EXEC_HEADER = ("from __future__ import division\n"
+        "from math import (sin, cos, tan, asin, acos, atan, atan2, sinh, "
+        "cosh, tanh,\n        exp, log, sqrt, fabs as Abs, pi)\n")
+
+# Code objects of exec_source() and functions of compile_function(), by hash
+code_cache = LRUCache(100)
+function_cache = LRUCache(100)
+
+# Functions which vectorized generated functions evaluate with NumPy, by
+# their printed name
+VECTORIZED_FUNCTIONS = {'sin': 'sin', 'cos': 'cos', 'tan': 'tan',
+        'exp': 'exp', 'log': 'log', 'sqrt': 'sqrt', 'asin': 'arcsin',
+        'acos': 'arccos', 'atan': 'arctan', 'atan2': 'arctan2',
+        'sinh': 'sinh', 'cosh': 'cosh', 'tanh': 'tanh', 'Abs': 'absolute',
+        'sign': 'sign'}
+
+# generate_function() eliminates common subexpressions by default once the
+# expressions it prints contain more than this many operations.
+CSE_OPS_THRESHOLD = 200
+
+def is_gc_atom(e):
+    """Returns True if e is a generalized coordinate or speed, its time
+    derivative, or the sine, cosine or tangent of one.
+    """
+    if isinstance(e, (Derivative, sin, cos, tan)):
+        e = e.args[0]
+    return hasattr(e, 'is_gc')
+
+def common_subexpressions(exprs, prefix='_cse'):
+    """Eliminate the common subexpressions of a list of expressions.
+
+    Returns a list of (Symbol, subexpression) pairs, in the order they must be
+    evaluated, and the list of reduced expressions.  The temporary Symbols are
+    named prefix0, prefix1, ...  Generalized coordinates and speeds, their time
+    derivatives and trigonometric functions of them are printed as plain names
+    by PyDyStrPrinter, so they are never replaced by a temporary.
+
+    SymPy's cse() may rewrite 1/x through a shared x**2 as (x**2)**(-1/2),
+    which loses the sign of x.  If a fractional power of a base which none
+    of exprs takes a fractional power of appears, or if the operation count
+    is not lowered, no temporaries are returned and exprs are returned
+    unchanged.
+
+    """
+    exprs = [S(e) for e in exprs]
+    replacements, reduced = sympy_cse(exprs, numbered_symbols(prefix))
+    trivial = {}
+    temps = []
+    for sym, e in replacements:
+        e = e.subs(trivial)
+        if is_gc_atom(e):
+            trivial[sym] = e
+        else:
+            temps.append((sym, e))
+    reduced = [e.subs(trivial) for e in reduced]
+
+    # Fractional powers of the expanded temporaries must be of bases which
+    # exprs already take fractional powers of
+    def fractional_bases(e):
+        return set([p.base for p in e.atoms(Pow) if not p.exp.is_Integer])
+    bases = set([])
+    for e in exprs:
+        bases |= fractional_bases(e)
+    values = {}
+    def expand_temps(e):
+        return e.subs(dict([(a, values[a]) for a in e.atoms(Symbol) if a in
+            values]))
+    for sym, e in temps:
+        values[sym] = expand_temps(e)
+    for e in [e for a, e in temps] + reduced:
+        for p in e.atoms(Pow):
+            if not p.exp.is_Integer and not fractional_bases(expand_temps(p)
+                    ) <= bases:
+                return [], exprs
+
+    ops = sum([count_ops(e) for e in exprs])
+    cse_ops = (sum([count_ops(e) for a, e in temps]) +
+            sum([count_ops(e) for e in reduced]))
+    if cse_ops >= ops:
+        return [], exprs
+    return temps, reduced
+
+def temporaries_needed(expr, temps, emitted):
+    """Return the (Symbol, subexpression) pairs of temps which must be
+    evaluated before expr, in order, skipping and then adding to the set
+    emitted.
+    """
+    needed = []
+    symbols = expr.atoms(Symbol)
+    for a, e in temps:
+        if a in symbols and a not in emitted:
+            needed += temporaries_needed(e, temps, emitted)
+            needed.append((a, e))
+            emitted.add(a)
+    return needed
+
 def generate_function(name, Eq_list, func_args, params=None, nested_terms=None,
-        docstring=None, triples=None, time=None):
+        docstring=None, triples=None, time=None, cse=None, vectorized=None,
+        out=None):
     """Generate a Python function in string form.
 
     Input:
@@ -97,6 +287,26 @@ def generate_function(name, Eq_list, func_args, params=None, nested_terms=None,
                     returned as a list of length 3 lists.
         time:       Boolean which will cause time to be an arugment in the
                     function signature.
+        cse:        Boolean which will cause common subexpressions of the
+                    nested terms and the equations to be computed once and
+                    stored in temporaries.  By default this is done when the
+                    expressions contain more than CSE_OPS_THRESHOLD
+                    operations.
+        vectorized: Boolean which will cause the function to evaluate the
+                    equations with NumPy for many states at once:  _x may be
+                    an array of shape (n_states, len(func_args)), the
+                    parameters (and t) may be arrays which broadcast against
+                    n_states, and an array of shape (n_states, len(Eq_list))
+                    (or (n_states, len(Eq_list)/3, 3) with triples) is
+                    returned.  A ValueError is raised if the equations
+                    contain a function not in VECTORIZED_FUNCTIONS.
+        out:        Boolean which will cause the function to return a NumPy
+                    array instead of a list, and to take an optional last
+                    argument _out, an array of shape (len(Eq_list),) (or
+                    (n_states, len(Eq_list)) when vectorized) into which the
+                    results are written.  Passing the same _out on every
+                    call, e.g. as the last entry of odeint's args, avoids
+                    allocating the result in the integration loop.
 
     Output:
         A Python string which is exec()-able and defines a function that
@@ -111,19 +321,35 @@ def generate_function(name, Eq_list, func_args, params=None, nested_terms=None,
     else:
         time_string = ""
     if params:
-        fs += "def " + name + "(_x" + time_string + ", _params):\n"
-    else:
-        fs += "def " + name + "(_x" + time_string + "):\n"
+        time_string += ", _params"
+    if out:
+        time_string += ", _out=None"
+    fs += "def " + name + "(_x" + time_string + "):\n"
 
     if docstring:
         fs += '    """' + docstring + '\n    """\n'
+    if vectorized:
+        for e in [eqn.rhs for eqn in Eq_list] + [v for nest in nested_terms
+                or [] for v in nest.values()]:
+            for f in S(e).atoms(Function):
+                if not (hasattr(f, 'is_gc') or f.func.__name__ in
+                        VECTORIZED_FUNCTIONS):
+                    raise ValueError("%s has no NumPy equivalent" %
+                            f.func.__name__)
+        fs += "    from numpy import asarray, empty, shape\n"
+        fs += "    from numpy import " + ", ".join([n == v and n or v +
+            " as " + n for n, v in sorted(VECTORIZED_FUNCTIONS.items())]) + \
+            "\n\n"
     arg_string = "    "
     for a in func_args:
         if isinstance(a, (Symbol, Derivative)):
             arg_string += str(a) + ", "
         elif isinstance(a, Function):
             arg_string += str(a.func) + ", "
-    arg_string = arg_string[:-2] + " = _x\n"
+    if vectorized:
+        arg_string = arg_string[:-2] + ", = asarray(_x).T\n"
+    else:
+        arg_string = arg_string[:-2] + " = _x\n"
     fs += "    # Unpack function arguments\n"
     fs += arg_string
     if params:
@@ -133,7 +359,10 @@ def generate_function(name, Eq_list, func_args, params=None, nested_terms=None,
                 param_string += str(p) + ", "
             elif isinstance(p, Function):
                 param_string += str(p.func) + ", "
-        param_string = param_string[:-2] + " = _params\n"
+        if vectorized:
+            param_string = param_string[:-2] + ", = _params\n"
+        else:
+            param_string = param_string[:-2] + " = _params\n"
         fs += "\n    # Unpack function parameters\n"
         fs += param_string
 
@@ -155,22 +384,48 @@ def generate_function(name, Eq_list, func_args, params=None, nested_terms=None,
             trig_string += "    " + str(tt) + " = " + str(type(tt)) + "(" + str(tt.args[0]) + ")\n"
         fs += trig_string
 
-    # Nested terms
+    # Nested terms, in the order they are evaluated
+    nested = []
     if nested_terms:
-        nested_string = "\n    # Nested terms\n"
         for nest in nested_terms:
             ntk = nest.keys()
             ntk.sort()
-            for nt in ntk:
-                nested_string += "    " + str(nt) + " = " + str(nest[nt]) + "\n"
-        fs += nested_string
+            nested += [(nt, nest[nt]) for nt in ntk]
+    rhs = [v for nt, v in nested] + [eqn.rhs for eqn in Eq_list]
+
+    temps = []
+    if cse or cse is None:
+        ops = sum([count_ops(e) for e in rhs])
+        if cse or ops > CSE_OPS_THRESHOLD:
+            temps, reduced = common_subexpressions(rhs)
+            if temps:
+                rhs = reduced
+                cse_ops = (sum([count_ops(e) for a, e in temps]) +
+                        sum([count_ops(e) for e in rhs]))
+                fs += ("\n    # Common subexpressions: %d operations reduced "
+                        "to %d\n" % (ops, cse_ops))
+    emitted = set([])
+    def emit(expr):
+        """Return the assignments of the temporaries expr depends upon."""
+        s = ""
+        for a, e in temporaries_needed(expr, temps, emitted):
+            s += "    " + str(a) + " = " + str(e) + "\n"
+        return s
+
+    if nested:
+        fs += "\n    # Nested terms\n"
+        for (nt, v), r in zip(nested, rhs):
+            fs += emit(r)
+            fs += "    " + str(nt) + " = " + str(r) + "\n"
+    rhs = rhs[len(nested):]
     ret_string = "    return ["
     fs += "\n    # Calculate return values\n"
     if triples:
         ret_string_d = ""
         i = 1
-        for eqn in Eq_list:
-            fs += "    " + str(eqn.lhs) + " = " + str(eqn.rhs) + "\n"
+        for eqn, r in zip(Eq_list, rhs):
+            fs += emit(r)
+            fs += "    " + str(eqn.lhs) + " = " + str(r) + "\n"
             ret_string_d += str(eqn.lhs) + ", "
             if i % 3 == 0:
                 ret_string += "[" + ret_string_d[:-2] + "], "
@@ -179,16 +434,284 @@ def generate_function(name, Eq_list, func_args, params=None, nested_terms=None,
                 continue
             i += 1
     else:
-        for eqn in Eq_list:
-            fs += "    " + str(eqn.lhs) + " = " + str(eqn.rhs) + "\n"
+        for eqn, r in zip(Eq_list, rhs):
+            fs += emit(r)
+            fs += "    " + str(eqn.lhs) + " = " + str(r) + "\n"
             ret_string += str(eqn.lhs) + ", "
     fs += "\n    # Return calculated values\n"
-    fs += ret_string[:-2] + "]\n\n"
+    if vectorized:
+        if out:
+            fs += "    if _out is None:\n    "
+        fs += "    _out = empty(shape(_x)[:-1] + (%d,))\n" % m
+        for i, eqn in enumerate(Eq_list):
+            fs += "    _out[..., %d] = %s\n" % (i, str(eqn.lhs))
+        if triples:
+            fs += "    return _out.reshape(shape(_x)[:-1] + (%d, 3))\n\n" % (
+                    m // 3)
+        else:
+            fs += "    return _out\n\n"
+    elif out:
+        fs += "    if _out is None:\n"
+        fs += "        from numpy import empty\n"
+        fs += "        _out = empty(%d)\n" % m
+        for i, eqn in enumerate(Eq_list):
+            fs += "    _out[%d] = %s\n" % (i, str(eqn.lhs))
+        if triples:
+            fs += "    return _out.reshape((%d, 3))\n\n" % (m // 3)
+        else:
+            fs += "    return _out\n\n"
+    else:
+        fs += ret_string[:-2] + "]\n\n"
 
     return fs
 
+def compile_function(name, Eq_list, func_args, params=None, nested_terms=None,
+        triples=None, time=None, backend='c', cache_dir=None):
+    """Compile the equations in Eq_list and return them as a callable.
+
+    The arguments are those of generate_function().  The returned function
+    has the same signature as the one generate_function() would define, with
+    an optional last argument _out as with out=True, and returns a NumPy
+    array.  _x, _params and _out should be contiguous float64 arrays; _x and
+    _params are converted otherwise.
+
+    backend:    'python' compiles the source of generate_function() in
+                memory, 'c' writes a C function which is compiled to a shared
+                library and called through ctypes, 'cython' writes a typed
+                Cython module, which requires Cython.
+    cache_dir:  The directory in which the sources and compiled libraries are
+                kept, by default pydy_cache_<uid> in the system's temporary
+                directory.  The file names contain a hash of the generated
+                source, so the equations are only compiled once.  As the
+                libraries found there are loaded, cache_dir must belong to
+                the user and not be writable by anyone else, otherwise
+                ValueError is raised.
+
+    The functions are also kept in memory, keyed by a hash of the equations
+    and options, so calling compile_function() again with the same arguments
+    returns the same function without generating any code.
+
+    """
+    from numpy import empty, float64, ascontiguousarray
+    from numpy.ctypeslib import ndpointer
+    if backend not in ('python', 'c', 'cython'):
+        raise ValueError("backend must be 'python', 'c' or 'cython'")
+    key = sha1(str((backend, cache_dir, name, Eq_list, func_args, params,
+        [sorted(nest.items()) for nest in nested_terms or []], triples,
+        time))).hexdigest()
+    f = function_cache.get(key)
+    if f is not None:
+        return f
+    if backend == 'python':
+        f = exec_source(generate_function(name, Eq_list, func_args, params,
+            nested_terms, triples=triples, time=time, out=True), name)
+        function_cache[key] = f
+        return f
+    cache_dir = private_directory(cache_dir)
+    m = len(Eq_list)
+
+    # Replace generalized coordinates and speeds, their derivatives and
+    # parameters which are Functions by Symbols with their printed names
+    def plain(a):
+        if isinstance(a, (Symbol, Derivative)) or hasattr(a, 'is_gc'):
+            return Symbol(str(a))
+        return Symbol(str(a.func))
+    args = [plain(a) for a in func_args]
+    p_args = [plain(p) for p in params or []]
+    functions = dict([(p, plain(p)) for p in params or [] if isinstance(p,
+        Function)])
+    def to_plain(e):
+        e = S(e)
+        e = e.subs(dict([(d, plain(d)) for d in e.atoms(Derivative)]))
+        e = e.subs(dict([(f, plain(f)) for f in e.atoms(Function) if
+            hasattr(f, 'is_gc')]))
+        return e.subs(functions)
+
+    # Nested terms and the left hand sides of Eq_list are assigned in order,
+    # later right hand sides may refer to them
+    lhs = []
+    if nested_terms:
+        for nest in nested_terms:
+            ntk = nest.keys()
+            ntk.sort()
+            lhs += [(to_plain(nt), to_plain(nest[nt])) for nt in ntk]
+    results = [to_plain(eqn.lhs) for eqn in Eq_list]
+    lhs += zip(results, [to_plain(eqn.rhs) for eqn in Eq_list])
+    temps, rhs = common_subexpressions([v for a, v in lhs])
+    emitted = set([])
+    assignments = []
+    for (a, v), r in zip(lhs, rhs):
+        assignments += temporaries_needed(r, temps, emitted) + [(a, r)]
+
+    if backend == 'c':
+        src = "#include <math.h>\n\n"
+        src += ("void " + name + "(const double *_x, double t, "
+                "const double *_params, double *_out)\n{\n")
+        for i, a in enumerate(args):
+            src += "    double %s = _x[%d];\n" % (a, i)
+        for i, a in enumerate(p_args):
+            src += "    double %s = _params[%d];\n" % (a, i)
+        for a, e in assignments:
+            src += "    double %s = %s;\n" % (a, ccode(e))
+        for i, r in enumerate(results):
+            src += "    _out[%d] = %s;\n" % (i, r)
+        src += "}\n"
+    else:
+        code = [(a, ccode(e)) for a, e in assignments]
+        # The functions of math.h which ccode() used
+        called = set(re.findall(r"\b([a-z]\w*)\(", " ".join([c for a, c in
+            code])))
+        src = "# cython: boundscheck=False, wraparound=False, cdivision=True\n"
+        if called:
+            src += "from libc.math cimport " + ", ".join(sorted(called)) + \
+                    "\n"
+        src += "import numpy as np\n"
+        src += "cimport numpy as np\n\n"
+        src += ("def " + name + "(np.ndarray[np.float64_t, ndim=1] _x, "
+                "double t, np.ndarray[np.float64_t, ndim=1] _params, "
+                "np.ndarray[np.float64_t, ndim=1] _out):\n")
+        for i, a in enumerate(args):
+            src += "    cdef double %s = _x[%d]\n" % (a, i)
+        for i, a in enumerate(p_args):
+            src += "    cdef double %s = _params[%d]\n" % (a, i)
+        for a, c in code:
+            src += "    cdef double %s = %s\n" % (a, c)
+        for i, r in enumerate(results):
+            src += "    _out[%d] = %s\n" % (i, r)
+    lib_name = name + "_" + sha1(backend + src).hexdigest()[:16]
+
+    if backend == 'c':
+        lib_path = os.path.join(cache_dir, lib_name + ".so")
+        if not os.path.exists(lib_path):
+            # Build in a directory of its own and move the library into place
+            # once it is complete, so that no other process can load a
+            # partially written one
+            build_dir = tempfile.mkdtemp(dir=cache_dir)
+            try:
+                compiler = new_compiler()
+                customize_compiler(compiler)
+                path = os.path.join(build_dir, lib_name)
+                open(path + ".c", 'w').write(src)
+                objects = compiler.compile([path + ".c"],
+                        output_dir=build_dir, extra_postargs=['-O2',
+                            '-fPIC'])
+                compiler.link_shared_object(objects, path + ".so")
+                os.rename(path + ".c", os.path.join(cache_dir, lib_name +
+                    ".c"))
+                os.rename(path + ".so", lib_path)
+            finally:
+                shutil.rmtree(build_dir)
+        double_array = ndpointer(float64, flags='C_CONTIGUOUS')
+        cfunc = getattr(ctypes.CDLL(lib_path), name)
+        cfunc.argtypes = [double_array, ctypes.c_double, double_array,
+                double_array]
+        cfunc.restype = None
+    else:
+        cfunc = load_cython_module(lib_name, cache_dir, src).__dict__[name]
+
+    # A Python function with the signature of generate_function()'s
+    fs = "def " + name + "(_x"
+    if time:
+        fs += ", t"
+    if params:
+        fs += ", _params"
+    fs += ", _out=None):\n"
+    fs += "    if _out is None:\n"
+    fs += "        _out = empty(%d)\n" % m
+    fs += "    _cfunc(ascontiguousarray(_x, float64), %s, %s, _out)\n" % (
+            "t" if time else "0.0", "ascontiguousarray(_params, float64)" if
+            params else "_no_params")
+    if triples:
+        fs += "    return _out.reshape((%d, 3))\n" % (m // 3)
+    else:
+        fs += "    return _out\n"
+    ns = {'_cfunc': cfunc, 'empty': empty, 'float64': float64,
+            'ascontiguousarray': ascontiguousarray, '_no_params': empty(0)}
+    exec fs in ns
+    function_cache[key] = ns[name]
+    return ns[name]
+
+def exec_source(source, names, header=EXEC_HEADER):
+    """Execute the generated source, preceded by header, in a new namespace
+    and return the function called names, or a list of the functions if names
+    is a list.
+
+    The code objects are cached in code_cache, keyed by a hash of the source,
+    so executing the same source again does not parse it again.
+    """
+    source = header + source
+    key = sha1(source).hexdigest()
+    code = code_cache.get(key)
+    if code is None:
+        code = compile(source, '<pydy generated code>', 'exec')
+        code_cache[key] = code
+    ns = {}
+    exec code in ns
+    if isinstance(names, str):
+        return ns[names]
+    return [ns[n] for n in names]
+
+def compile_linear_transform(B, params, name, det=None, nested_terms=None,
+        x=None, y=None, sparse=None):
+    """Return the function defined by linear_transform() with these
+    arguments, compiled in memory by exec_source().
+    """
+    return exec_source(linear_transform(B, params, name, det, nested_terms, x,
+        y, sparse=sparse), name)
+
+def private_directory(path=None):
+    """Return path, by default pydy_cache_<uid> in the system's temporary
+    directory, after creating it if needed.
+
+    Raises ValueError if the directory does not belong to the user or can be
+    written by others, as compiled code found in it is loaded.
+    """
+    uid = os.getuid()
+    if path is None:
+        path = os.path.join(tempfile.gettempdir(), 'pydy_cache_%d' % uid)
+    if not os.path.isdir(path):
+        os.makedirs(path, 0700)
+    st = os.stat(path)
+    if st.st_uid != uid or st.st_mode & 022:
+        raise ValueError("%s must belong to the user and not be writable by "
+                "others" % path)
+    return path
+
+def load_cython_module(module_name, cache_dir, src):
+    """Build (unless already built) and import the Cython module module_name
+    with source src, keeping the files in cache_dir.
+    """
+    from distutils.core import Distribution, Extension
+    from Cython.Build import cythonize
+    import numpy
+    build_dir = None
+    try:
+        dist = Distribution({'ext_modules': [Extension(module_name,
+            [module_name + ".pyx"], include_dirs=[numpy.get_include()])]})
+        build = dist.get_command_obj('build_ext')
+        build.build_lib = cache_dir
+        build.ensure_finalized()
+        lib_path = build.get_ext_fullpath(module_name)
+        if not os.path.exists(lib_path):
+            # Build in a directory of its own, as in compile_function()
+            build_dir = tempfile.mkdtemp(dir=cache_dir)
+            path = os.path.join(build_dir, module_name)
+            open(path + ".pyx", 'w').write(src)
+            build.extensions[0].sources = [path + ".pyx"]
+            build.build_lib = build_dir
+            build.build_temp = os.path.join(build_dir, 'build')
+            build.extensions = cythonize(build.extensions, quiet=True)
+            build.run()
+            os.rename(path + ".pyx", os.path.join(cache_dir, module_name +
+                ".pyx"))
+            os.rename(build.get_ext_fullpath(module_name), lib_path)
+    finally:
+        if build_dir:
+            shutil.rmtree(build_dir)
+    return imp.load_dynamic(module_name, lib_path)
+
 def linear_transform(B, params, name, det=None, nested_terms=None, x=None,\
-        y=None, docstring=None):
+        y=None, docstring=None, sparse=None):
     """Given a m x n matrix of Sympy expressions, return an exec-able string
     which would define the Python function mapping x \in R^n to y \in R^m.
 
@@ -210,6 +733,11 @@ def linear_transform(B, params, name, det=None, nested_terms=None, x=None,\
         quantities which are not in the parameter list, but depend upon
         quantities in the parameter list.
 
+        sparse:  Evaluate 1/det once, multiply only by the nonzero entries of
+        B, and compute the common subexpressions of the entries once.  The
+        function then also accepts an array of shape (k, n) of k x vectors,
+        and returns an array of shape (k, m) (or (m,) for one x).
+
     Returns:
         A string with the function signature:
             def name(x, params):
@@ -245,10 +773,14 @@ def linear_transform(B, params, name, det=None, nested_terms=None, x=None,\
                 x_string += str(x[j]) + ", "
         x_var = Matrix(x_var)
     else:
-        x_var = Matrix([n, 1], lambda i,j: Symbol("_x%d"%j))
+        x_var = Matrix(n, 1, lambda i,j: Symbol("_x%d"%i))
         for j in range(n):
             x_string += "_x%d"%j + ", "
-    x_string = x_string[:-2] + " = _x\n"
+    if sparse:
+        fs += "    from numpy import asarray, empty, shape\n"
+        x_string = x_string[:-2] + ", = asarray(_x).T\n"
+    else:
+        x_string = x_string[:-2] + " = _x\n"
 
     fs += "    " + x_string
     fs += "    " + param_string
@@ -279,6 +811,35 @@ def linear_transform(B, params, name, det=None, nested_terms=None, x=None,\
                 nested_string += "    " + str(nt) + " = " + str(nest[nt]) + "\n"
         fs += nested_string
 
+    if sparse:
+        entries = [(i, j) for i in range(m) for j in range(n) if B[i, j] != 0]
+        # The determinant shares its subexpressions with the entries
+        exprs = [B[i, j] for i, j in entries]
+        if det:
+            exprs.append(det)
+        temps, reduced = common_subexpressions(exprs)
+        for a, e in temps:
+            fs += "    " + str(a) + " = " + str(e) + "\n"
+        if det:
+            fs += "    _idet = 1.0/(" + str(reduced.pop()) + ")\n"
+        rows = [[] for i in range(m)]
+        for (i, j), Bij in zip(entries, reduced):
+            rows[i].append(str(Bij*x_var[j]))
+        fs += "    _y = empty(shape(_x)[:-1] + (%d,))\n" % m
+        for i in range(m):
+            row = " + ".join(rows[i]) or "0"
+            if det and rows[i]:
+                row = "(" + row + ")*_idet"
+            if y:
+                yi = str(y[i])
+                if yi[-1] == "'":
+                    yi = yi[:-1] + "p"
+                fs += "    " + yi + " = " + row + "\n"
+                row = yi
+            fs += "    _y[..., %d] = %s\n" % (i, row)
+        fs += "    return _y\n\n"
+        return fs
+
     if det:
         fs += "    det = " + str(det) + "\n"
 
@@ -316,7 +877,8 @@ def linear_transform(B, params, name, det=None, nested_terms=None, x=None,\
 
     return fs
 
-def transform_matrix(B, x, x_dependent, subs_dict=None, time=None):
+def transform_matrix(B, x, x_dependent, subs_dict=None, time=None,
+        method='adjugate', stats=None):
     """Given an m x n coefficent matrix B, n linear terms x, and m linear terms
     xd taken to be dependent, return the transform matrix between the
     independent linear terms and the dependent ones.
@@ -345,9 +907,24 @@ def transform_matrix(B, x, x_dependent, subs_dict=None, time=None):
     xd = -inv(Bd)*Bi*xi
        = T*xi
 
-    Returns: -inv(Bd), Bi, substitution_dict
+    Returns: -inv(Bd), Bi, substitution_dict with method='adjugate' (without
+    substitution_dict if subs_dict is not given), T, substitution_dict with
+    method='sparse' (T only if subs_dict is not given).
+
+    With method='sparse', Bd*T = -Bi is instead solved by sparse_solve(),
+    eliminating with the pivots that cause the least fill-in (Markowitz
+    criterion) and naming every intermediate result by a dummy symbol
+    z0001, z0002, ..., so no adjugate or determinant is formed.  If
+    subs_dict is not given, the dummy symbols are substituted back without
+    expanding (see substitute_intermediates()).  If stats is a dictionary,
+    the statistics of sparse_solve() are stored in it, including the number
+    of divisions, multiplications and subtractions of the elimination
+    ('ops'), along with the number a dense elimination of Bd would take
+    ('dense_ops').
 
     """
+    if method not in ('adjugate', 'sparse'):
+        raise ValueError("method must be 'adjugate' or 'sparse'")
     m, n = B.shape
     md = len(x_dependent)
     if m != md:
@@ -379,6 +956,23 @@ def transform_matrix(B, x, x_dependent, subs_dict=None, time=None):
     for j, ji in enumerate(independent_ci):
         Bi[:, j] = B_dummy[:, ji]
 
+    if method == 'sparse':
+        if stats is None:
+            stats = {}
+        T, z_dict = sparse_solve(Bd, -Bi, 'z', pivoting='markowitz',
+                stats=stats)
+        k = n - m
+        # Divisions, multiplications and subtractions of dense elimination
+        # and back substitution, counted as sparse_solve() counts them
+        stats['dense_ops'] = sum([r + 2*r**2 + 2*r*k for r in range(m)]) + \
+                k*sum([2*i + 1 for i in range(m)])
+        if subs_dict == None:
+            T_list = substitute_intermediates(T, z_dict)
+            return Matrix(m, k, lambda i, j: T_list[i*k + j].subs(d))
+        else:
+            d.update(z_dict)
+            return T, d
+
     # Invert the Bd matrix and determine
     # xd = -inv(Bd) * Bi * xi = T * xi
     # Form the adjugate and matrix multiply by Bi
@@ -572,6 +1166,138 @@ def dummy_matrix(mat, char, time=None):
                         new_mat[i, j] = ds
     return new_mat, d
 
+def sparse_solve(A, B, char='z', pivoting='diagonal', stats=None):
+    """Solves A*X = B by sparse symbolic Gaussian elimination.
+
+    A is a square Matrix, typically of dummy symbols (see dummy_matrix()),
+    and B a Matrix with as many rows.  Each multiplier, updated entry and
+    back substituted unknown which is not a single symbol or number is
+    replaced by a new dummy symbol whose name starts with char, so that no
+    expression grows beyond a product and a sum of a few symbols.
+
+    Pivots are chosen to keep the elimination sparse, by the Markowitz
+    criterion: the entry minimizing (r - 1)*(c - 1), where r and c are the
+    number of nonzero entries in its row and column.  With
+    pivoting='diagonal' only diagonal entries are considered (minimum degree
+    ordering, suited to symmetric matrices such as mass matrices) unless
+    none is nonzero; pivoting='markowitz' considers every entry.
+
+    Returns the Matrix X and a dictionary with the new dummy symbols as keys
+    and the expressions they represent as values.  The names are numbered
+    with a fixed width in the order the symbols are created, so sorting the
+    keys gives an order in which they can be evaluated.  If stats is a
+    dictionary, the pivots, the number of dummy symbols, the number of
+    fill-in entries and the number of divisions, multiplications and
+    subtractions performed ('ops') are stored in it.
+    """
+    if pivoting not in ('diagonal', 'markowitz'):
+        raise ValueError("pivoting must be 'diagonal' or 'markowitz'")
+    n = A.shape[0]
+    assert A.shape == (n, n)
+    assert B.shape[0] == n
+    k = B.shape[1]
+    width = len(str((n + k)**3))
+    rows = [dict([(j, S(A[i, j])) for j in range(n) if A[i, j] != 0]) for i
+            in range(n)]
+    rhs = [dict([(j, S(B[i, j])) for j in range(k) if B[i, j] != 0]) for i
+            in range(n)]
+    cols = [set([i for i in range(n) if j in rows[i]]) for j in range(n)]
+    d = {}
+    fill_in = [0]
+    ops = [0]
+
+    def name(expr):
+        if expr.is_Atom or (-expr).is_Atom:
+            return expr
+        z = Dummy(char + '%0*d' % (width, len(d)))
+        d[z] = expr
+        return z
+
+    pivots = []
+    rows_left = range(n)
+    for step in range(n):
+        best = None
+        for diagonal in ([True, False] if pivoting == 'diagonal' else
+                [False]):
+            for r in rows_left:
+                if diagonal:
+                    candidates = [r] if r in rows[r] else []
+                else:
+                    candidates = sorted(rows[r])
+                for c in candidates:
+                    cost = (len(rows[r]) - 1) * (len(cols[c]) - 1)
+                    if best is None or cost < best[0]:
+                        best = (cost, r, c)
+            if best is not None:
+                break
+        if best is None:
+            raise ValueError('Matrix is singular')
+        cost, r, c = best
+        rows_left.remove(r)
+        prow = rows[r]
+        for j in prow:
+            cols[j].discard(r)
+        pivot = prow[c]
+        for i in sorted(cols[c]):
+            l = name(rows[i].pop(c) / pivot)
+            ops[0] += 1 + 2*(len(prow) - 1 + len(rhs[r]))
+            for j, a_rj in prow.items():
+                if j == c:
+                    continue
+                if j not in rows[i]:
+                    fill_in[0] += 1
+                new = rows[i].get(j, 0) - l*a_rj
+                if new == 0:
+                    rows[i].pop(j, None)
+                    cols[j].discard(i)
+                else:
+                    rows[i][j] = name(new)
+                    cols[j].add(i)
+            for j, b_rj in rhs[r].items():
+                new = rhs[i].get(j, 0) - l*b_rj
+                if new == 0:
+                    rhs[i].pop(j, None)
+                else:
+                    rhs[i][j] = name(new)
+        cols[c] = set([])
+        pivots.append((r, c))
+
+    X = zeros((n, k))
+    for r, c in reversed(pivots):
+        pivot = rows[r][c]
+        for j in range(k):
+            s = rhs[r].get(j, 0)
+            for jj, a in rows[r].items():
+                if jj != c:
+                    s -= a*X[jj, j]
+            X[c, j] = name(s / pivot)
+            ops[0] += 2*len(rows[r]) - 1
+
+    if stats is not None:
+        stats['pivots'] = pivots
+        stats['dummies'] = len(d)
+        stats['fill_in'] = fill_in[0]
+        stats['ops'] = ops[0]
+    return X, d
+
+def substitute_intermediates(exprs, d):
+    """Returns exprs with the dummy symbols created by sparse_solve(), the
+    keys of d, replaced by the expressions they represent.
+
+    Each intermediate is substituted into the later ones once, in the order
+    they were created, and nothing is expanded, so the results share their
+    subexpressions instead of multiplying out nested quotients.
+    """
+    values = {}
+    def substitute(e):
+        return e.subs(dict([(a, values[a]) for a in e.atoms(Symbol) if a in
+            values]))
+    z_list = d.keys()
+    z_list.sort()
+    for z in z_list:
+        values[z] = substitute(d[z])
+    return [substitute(S(e)) for e in exprs]
+
 def matrixv_multiply(A, B):
     """For multplying a matrix of PyDy Vector/UnitVectors with matrices of
     Sympy expressions.
@@ -594,20 +1320,21 @@ def matrixv_multiply(A, B):
                         p = {}
                         for uv, val in aik.dict.items():
                             p[uv] = bkj*val
+                        s += Vector.trusted(p)
                     elif isinstance(aik, UnitVector):
                         assert not isinstance(bkj, (UnitVector, Vector))
-                        p = bkj*aik
+                        s += Vector(bkj*aik)
                     elif isinstance(bkj, Vector):
                         assert not isinstance(aik, (UnitVector, Vector))
                         p = {}
                         for uv, val in bkj.dict.items():
                             p[uv] = aik*val
+                        s += Vector.trusted(p)
                     elif isinstance(bkj, UnitVector):
                         assert not isinstance(aik, (UnitVector, Vector))
-                        p = aik*bkj
+                        s += Vector(aik*bkj)
                     else:
                         raise NotImplementedError()
-                    s += Vector(p)
                 product[i, j] = s
     return product
 
@@ -707,7 +1434,9 @@ def dt(v, frame):
 
 def GeneralizedCoordinate(s, constant=False):
     gc = Symbol(s)(Symbol('t'))
-    gc.is_gc = True
+    # Also mark the function class, so that instances rebuilt by SymPy (e.g.
+    # by subs) still print as s rather than s(t)
+    gc.is_gc = gc.func.is_gc = True
     if constant==True:
         gc.fdiff = lambda argindex: 0
     gc.__repr__ = lambda self: PyDyStrPrinter().doprint(self)
@@ -0,0 +1,166 @@
+from numpy import (asarray, empty, empty_like, multiply, add, absolute,
+        maximum, divide, diff)
+
+# Fixed step and adaptive integrators for the functions made by
+# generate_function().  They take f(x, t, *args) like scipy's odeint, return
+# the states at every time in t, and accept a whole batch of initial
+# conditions as an array of shape (k, n) when f is vectorized; the result
+# then has shape (len(t), k, n).  All work arrays are allocated before the
+# first step.  With inplace=True, f is called as f(x, t, *(args + (out,))) and
+# must write its result into out, as the functions generated with out=True
+# do.
+
+def evaluate(f, x, t, args, inplace, out):
+    """Stores f(x, t, *args) in out."""
+    if inplace:
+        f(x, t, *(args + (out,)))
+    else:
+        out[...] = f(x, t, *args)
+    return out
+
+def rk4(f, x0, t, args=(), inplace=False):
+    """Integrates dx/dt = f(x, t, *args) from x0 with the classical fourth
+    order Runge-Kutta method, taking one step between successive times of t.
+
+    Returns an array with the states at the times in t, the first being x0.
+    """
+    x0 = asarray(x0, dtype=float)
+    t = asarray(t, dtype=float)
+    result = empty((len(t),) + x0.shape)
+    result[0] = x0
+    k1, k2, k3, k4, y = [empty_like(x0) for i in range(5)]
+    for i in range(len(t) - 1):
+        x = result[i]
+        ti = t[i]
+        h = t[i + 1] - ti
+        evaluate(f, x, ti, args, inplace, k1)
+        multiply(k1, h/2, y)
+        y += x
+        evaluate(f, y, ti + h/2, args, inplace, k2)
+        multiply(k2, h/2, y)
+        y += x
+        evaluate(f, y, ti + h/2, args, inplace, k3)
+        multiply(k3, h, y)
+        y += x
+        evaluate(f, y, ti + h, args, inplace, k4)
+        # x + h/6*(k1 + 2*k2 + 2*k3 + k4)
+        add(k2, k3, y)
+        y *= 2
+        y += k1
+        y += k4
+        y *= h/6
+        add(x, y, result[i + 1])
+    return result
+
+# Dormand-Prince coefficients: nodes, stage weights, fifth order weights and
+# the difference between the fifth and fourth order weights
+DP_C = (0., 1/5., 3/10., 4/5., 8/9., 1., 1.)
+DP_A = ((),
+        (1/5.,),
+        (3/40., 9/40.),
+        (44/45., -56/15., 32/9.),
+        (19372/6561., -25360/2187., 64448/6561., -212/729.),
+        (9017/3168., -355/33., 46732/5247., 49/176., -5103/18656.),
+        (35/384., 0., 500/1113., 125/192., -2187/6784., 11/84.))
+DP_E = (71/57600., 0., -71/16695., 71/1920., -17253/339200., 22/525.,
+        -1/40.)
+
+def rk45(f, x0, t, args=(), inplace=False, rtol=1e-6, atol=1e-9, h0=None,
+        max_steps=100000):
+    """Integrates dx/dt = f(x, t, *args) from x0 with the adaptive Dormand
+    Prince Runge-Kutta 5(4) method.
+
+    Steps are chosen so that the estimated error of every component is less
+    than atol + rtol*|x|; in a batch all initial conditions share the steps.
+    The steps end exactly at the times in t, whose states are returned as
+    with rk4().  t may be decreasing, to integrate backwards in time, but
+    must be monotonic, otherwise ValueError is raised.  h0 is the size of the
+    first step, by default a hundredth of the first interval of t.
+    """
+    x0 = asarray(x0, dtype=float)
+    t = asarray(t, dtype=float)
+    result = empty((len(t),) + x0.shape)
+    result[0] = x0
+    k = [empty_like(x0) for i in range(7)]
+    x, y, tmp, err, scale = [empty_like(x0) for i in range(5)]
+    x[...] = x0
+    if len(t) < 2:
+        return result
+    dt = diff(t)
+    if not ((dt > 0).all() or (dt < 0).all()):
+        raise ValueError("t must be strictly increasing or decreasing")
+    # Steps, like t, go in the direction of the integration
+    direction = 1. if dt[0] > 0 else -1.
+    h = direction * abs(h0 or dt[0] / 100.)
+    tc = t[0]
+    evaluate(f, x, tc, args, inplace, k[0])
+    steps = 0
+    for i in range(1, len(t)):
+        while direction * (t[i] - tc) > 0:
+            if steps == max_steps:
+                raise ValueError("More than %d steps were needed" % max_steps)
+            steps += 1
+            last = direction * (tc + h - t[i]) >= 0
+            if last:
+                # Shortened to end at t[i]; h is restored after the step
+                h_full = h
+                h = t[i] - tc
+            for s in range(1, 7):
+                y[...] = x
+                for j, a in enumerate(DP_A[s]):
+                    if a:
+                        multiply(k[j], h*a, tmp)
+                        y += tmp
+                evaluate(f, y, tc + DP_C[s]*h, args, inplace, k[s])
+            # y is now the fifth order solution; estimate the error
+            err[...] = 0
+            for j, e in enumerate(DP_E):
+                if e:
+                    multiply(k[j], h*e, tmp)
+                    err += tmp
+            absolute(x, tmp)
+            absolute(y, scale)
+            maximum(tmp, scale, scale)
+            scale *= rtol
+            scale += atol
+            absolute(err, err)
+            divide(err, scale, err)
+            error = err.max()
+            if error <= 1:
+                tc = t[i] if last else tc + h
+                x, y = y, x
+                # First same as last
+                k[0], k[6] = k[6], k[0]
+                if last:
+                    h = h_full
+                    continue
+            if tc + h == tc:
+                raise ValueError("Step size underflow at t = %g" % tc)
+            h *= min(5., max(0.2, 0.9 * (error or 1e-10)**-0.2))
+        result[i] = x
+    return result
+
+def semi_implicit_euler(f, x0, t, nq, args=(), inplace=False):
+    """Integrates dx/dt = f(x, t, *args) from x0 with the symplectic
+    (semi-implicit) Euler method, x being nq coordinates followed by the
+    speeds.  Each step first advances the speeds, then the coordinates with
+    the kinematic differential equations evaluated at the new speeds.
+    States are returned as with rk4().
+    """
+    x0 = asarray(x0, dtype=float)
+    t = asarray(t, dtype=float)
+    result = empty((len(t),) + x0.shape)
+    result[0] = x0
+    k, y = empty_like(x0), empty_like(x0)
+    for i in range(len(t) - 1):
+        x = result[i]
+        h = t[i + 1] - t[i]
+        evaluate(f, x, t[i], args, inplace, k)
+        y[..., :nq] = x[..., :nq]
+        multiply(k[..., nq:], h, y[..., nq:])
+        y[..., nq:] += x[..., nq:]
+        evaluate(f, y, t[i + 1], args, inplace, k)
+        multiply(k[..., :nq], h, y[..., :nq])
+        y[..., :nq] += x[..., :nq]
+        result[i + 1] = y
+    return result
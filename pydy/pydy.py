@@ -1,13 +1,19 @@
 import time
+import multiprocessing
+import os
+import tempfile
+import cPickle as pickle
+from hashlib import sha1
+from itertools import count
 
 from sympy import (Symbol, symbols, Basic, Function, Mul, Pow, Matrix, sin,
         cos, tan, cot, S, eye, Add, trigsimp, expand, pretty, Eq, collect, sqrt,
         sympify, factor, zeros, simplify, solve_linear_system, ratsimp,
-        powsimp, block_diag, Derivative, Expr)
+        powsimp, block_diag, Derivative, Expr, Dummy, srepr)
 from sympy.printing.pretty.pretty import PrettyPrinter
 from sympy.printing.str import StrPrinter
 
-from common import e1, e2, e3, zero, t
+from common import e1, e2, e3, zero, t, LRUCache
 
 Basic.__str__ = lambda self: PyDyStrPrinter().doprint(self)
 Basic.__repr__ = lambda self: PyDyStrPrinter().doprint(self)
@@ -15,26 +21,32 @@ Matrix.__str__ = lambda self: PyDyStrPrinter().doprint(self)
 
 class UnitVector(Expr):
     """A standard unit vector  with a symbolic and a numeric representation.
+
+    A UnitVector is identified by the integer key 4*frame.frame_id + i, which
+    is also its hash, so dictionary lookups and comparisons between
+    UnitVectors never have to build or compare SymPy objects.  The numeric
+    representation is one of the Matrices e1, e2, e3 shared by all frames.
     """
+    __slots__ = ['frame', 'i', 'key', 'common_frames']
+    _num = (zero, e1, e2, e3)
 
     def __init__(self, frame, i=0): #=-1,num=None):
         self.frame = frame    # Parent reference frame
         self.common_frames = set([frame])
         self.i = i
-        self.v = {}
-        s = frame.name
-        if i == 1:
-            self.v['sym'] = Symbol(s.lower()+str(i))
-            self.v['num'] = e1
-        elif i == 2:
-            self.v['sym'] = Symbol(s.lower()+str(i))
-            self.v['num'] = e2
-        elif i == 3:
-            self.v['sym'] = Symbol(s.lower()+str(i))
-            self.v['num'] = e3
-        elif i == 0:
-            self.v['sym'] = Symbol(s.lower()+str(0))
-            self.v['num'] = zero
+        self.key = 4*frame.frame_id + i
+        self._mhash = hash(self.key)
+
+    @property
+    def num(self):
+        """Numeric representation of the UnitVector, as a 3 x 1 Matrix."""
+        return self._num[self.i]
+
+    def __hash__(self):
+        return self._mhash
+
+    def _hashable_content(self):
+        return (self.key,)
 
     def __str__(self):
         return PyDyStrPrinter().doprint(self)
@@ -44,28 +56,24 @@ class UnitVector(Expr):
 
     def __cmp__(self, other):
         if isinstance(other, UnitVector):
-            if self.frame == other.frame:
-                return cmp(self.i, other.i)
-            else:
-                return cmp(len(self.frame.ref_frame_list),
-                       len(other.frame.ref_frame_list))
+            return sort_UnitVector(self, other)
         else:
             raise NotImplementedError()
 
     def __eq__(self, other):
         if isinstance(other, UnitVector):
-            if other.frame == self.frame:
-                return (self.v['num'] == other.v['num'])
+            if other.frame is self.frame:
+                return self.i == other.i
             else:
                 other_selfframe = other.express(self.frame)
                 if isinstance(other_selfframe, UnitVector):
-                    return (self.v['num'] == other_selfframe.v['num'])
+                    return self.i == other_selfframe.i
                 else:
                     return False
         elif isinstance(other, Vector):
             other_selfframe = other.express(self.frame)
             if isinstance(other_selfframe, UnitVector):
-                return (self.v['num'] == other_selfframe.v['num'])
+                return self.i == other_selfframe.i
             else:
                 return False
         elif isinstance(other, (Add, Mul)):
@@ -90,50 +98,38 @@ class UnitVector(Expr):
         if self.frame == frame:
             return self
         else:
-            frame_list = self.frame.get_frames_list(frame)
-            if len(self.common_frames) > 1:
-                # Means that self is fixed in more than one frame
-                for cf in self.common_frames:
-                    if cf == self.frame:
-                        continue
-                    elif cf in frame_list:
-                        fl = cf.get_frames_list(frame)
-                        if len(fl) < len(frame_list):
-                            frame_list = fl
-                matrices = frame_list[0].get_rot_matrices(frame_list[-1])
-            else:
-                matrices = self.frame.get_rot_matrices(frame)
-            if len(matrices) == 1 and matrices[0]*self.v['num'] == self.v['num']:
+            C = self.nearest_frame(frame).get_dcm(frame)
+            u = C*self.num
+            if u == self.num:
                 return frame[self.i]
             else:
-                u = self.v['num']
-                for m in reversed(matrices):
-                    u = m*u
                 return Vector(u[0]*frame[1] + u[1]*frame[2] + u[2]*frame[3])
 
+    def nearest_frame(self, frame):
+        """Returns the frame, among all frames self is fixed in, with the
+        shortest path to frame.
+        """
+        if len(self.common_frames) == 1:
+            return self.frame
+        # Means that self is fixed in more than one frame
+        frame_list = self.frame.get_frames_path(frame)
+        for cf in self.common_frames:
+            if cf == self.frame:
+                continue
+            elif cf in frame_list:
+                fl = cf.get_frames_path(frame)
+                if len(fl) < len(frame_list):
+                    frame_list = fl
+        return frame_list[0]
+
     def dot(self, other):
         """UnitVector dot product.
         """
         if isinstance(other, UnitVector):
             nrf = self.frame.NewtonianReferenceFrame
-            if (self, other) in nrf.uv_dot_products:
-                return nrf.uv_dot_products[(self, other)]
-            elif (other, self) in nrf.uv_dot_products:
-                return nrf.uv_dot_products[(other, self)]
-            else:
-                c = other.express(self.frame)
-                if isinstance(c, UnitVector):
-                    dp = (self.v['num'].T * c.v['num'])[0]
-                    self.frame.NewtonianReferenceFrame.uv_dot_products[(self, \
-                        other)] = dp
-                    return dp
-                elif isinstance(c, Vector):
-                    s = c.dict.get(self, 0)
-                    self.frame.NewtonianReferenceFrame.uv_dot_products[(self, \
-                        other)] = s
-                    return s
-                else:
-                    raise NotImplementedError()
+            if (self, other) not in nrf.uv_dot_products:
+                self.frame.compute_uv_products(other.frame)
+            return nrf.uv_dot_products[(self, other)]
         elif isinstance(other, Vector):
             s = S(0)
             for k, c in other.dict.items():
@@ -156,7 +152,7 @@ class UnitVector(Expr):
                 elif isinstance(term, Vector):
                     for kt in term.dict:
                         cp[kt] = cp.get(kt, 0) + coef*term.dict[kt]
-            return Vector(cp)
+            return Vector.trusted(cp)
 
         if isinstance(other, UnitVector):
             nrf = self.frame.NewtonianReferenceFrame
@@ -165,64 +161,8 @@ class UnitVector(Expr):
             elif (other, self) in nrf.uv_cross_products:
                 return -nrf.uv_cross_products[(other, self)]
             else:
-                c = other.express(self.frame)
-                #print self.frame
-                if isinstance(c, UnitVector):
-                    cp_list = [self.v['num'][1]*c.v['num'][2] - \
-                            self.v['num'][2]*c.v['num'][1], \
-                            -self.v['num'][0]*c.v['num'][2] + \
-                            self.v['num'][2]*c.v['num'][0],  \
-                            self.v['num'][0]*c.v['num'][1] - \
-                            self.v['num'][1]*c.v['num'][0]]
-                    cp = {}
-                    for (c, i) in zip(cp_list, [1, 2, 3]):
-                        if c != 0:
-                            cp.update({self.frame[i] : c})
-                    if len(cp) == 0:
-                        return Vector(0)
-                    elif len(cp) == 1:
-                        if cp.values()[0] == 1:
-                            return cp.keys()[0]  # Return a UnitVector object
-                        else:
-                            return Vector(cp)
-                    else:
-                        cp1 = Vector(cp)
-                        cp2 = cp1.express(other.frame)
-                        if isinstance(cp2, UnitVector):
-                            return cp2
-                        else:
-                            for k in cp1.dict:
-                                cp1.dict[k] = trigsimp(cp1.dict[k])
-                            for k in cp2.dict:
-                                cp2.dict[k] = trigsimp(cp2.dict[k])
-                            if isinstance(cp1, UnitVector):
-                                return cp1
-                            elif isinstance(cp2, UnitVector):
-                                return cp2
-                            elif len(cp1.dict) <= len(cp2.dict):
-                                return cp1
-                            else:
-                                return cp2
-                elif isinstance(c, Vector):
-                    cp1 = cross_with_Vector(self, c)
-                    cp2 = cp1.express(other.frame)
-                    if isinstance(cp1, UnitVector):
-                        return cp1
-                    elif isinstance(cp2, UnitVector):
-                        return cp2
-                    else:
-                        for k in cp1.dict:
-                            cp1.dict[k] = trigsimp(cp1.dict[k])
-                        for k in cp2.dict:
-                            cp2.dict[k] = trigsimp(cp2.dict[k])
-                        if isinstance(cp1, UnitVector):
-                            return cp1
-                        elif isinstance(cp2, UnitVector):
-                            return cp2
-                        elif len(cp1.dict) <= len(cp2.dict):
-                            return cp1
-                        else:
-                            return cp2
+                self.frame.compute_uv_products(other.frame)
+                return nrf.uv_cross_products[(self, other)]
         elif isinstance(other, Vector):
             return cross_with_Vector(self, other)
         else:
@@ -424,6 +364,9 @@ class Vector(Basic):
         True
 
     """
+    # When True, Vectors built through Vector.trusted() are checked as
+    # thoroughly as those built through Vector.__init__.
+    debug = False
 
     def __init__(self, v):
         """Initialize a Vector object.
@@ -467,6 +410,34 @@ class Vector(Basic):
                 if vdict[k] == 0:  vdict.pop(k)
             self.dict = vdict
 
+    @classmethod
+    def trusted(cls, d):
+        """Build a Vector from a dictionary produced by PyDy itself.
+
+        Unlike Vector(d), the coefficients are not passed through sympify
+        and are not compared to zero; the only pruning is of entries that
+        are identically S.Zero, which is what SymPy arithmetic, expand() and
+        subs() return when a coefficient cancels.  Only for use on
+        dictionaries whose keys are UnitVectors and whose values are already
+        SymPy expressions.  Set Vector.debug = True to validate every
+        dictionary passed through here.
+        """
+        for k in [k for k, v in d.items() if v is S.Zero]:
+            del d[k]
+        if cls.debug:
+            for k, v in d.items():
+                if not isinstance(k, UnitVector):
+                    raise TypeError('Vector keys must be UnitVectors, got %s'
+                            % type(k))
+                if not isinstance(v, Basic):
+                    raise TypeError('Coefficient of %s is a %s, not a SymPy '
+                            'expression' % (k, type(v)))
+                if v == 0:
+                    raise ValueError('Coefficient of %s is zero' % k)
+        vec = Basic.__new__(cls)
+        vec.dict = d
+        return vec
+
     def __str__(self):
         return PyDyStrPrinter().doprint(self)
 
@@ -493,8 +464,12 @@ class Vector(Basic):
         L{__sub__}
         """
         if isinstance(other, Vector):
-            sum = dict([(k, self.dict.get(k, 0) + other.dict.get(k, 0)) for k in
-                    (self.dict.keys() + other.dict.keys())])
+            sum = dict(self.dict)
+            for k, v in other.dict.items():
+                if k in sum:
+                    sum[k] = sum[k] + v
+                else:
+                    sum[k] = v
 
             if len(sum) == 1 and sum[sum.keys()[0]] == 1:
                 return sum.keys()[0]
@@ -526,8 +501,12 @@ class Vector(Basic):
         L{__add__}
         """
         if isinstance(other, Vector):
-            dif = dict([(k, self.dict.get(k, 0) - other.dict.get(k, 0)) for k in
-                    (self.dict.keys() + other.dict.keys())])
+            dif = dict(self.dict)
+            for k, v in other.dict.items():
+                if k in dif:
+                    dif[k] = dif[k] - v
+                else:
+                    dif[k] = -v
             if len(dif) == 1 and dif[dif.keys()[0]] == 1:
                 return dif.keys()[0]
             else:
@@ -602,7 +581,7 @@ class Vector(Basic):
     """
 
     def __neg__(self):
-        return Vector(dict([(k, -self.dict[k]) for k in self.dict]))
+        return Vector.trusted(dict([(k, -self.dict[k]) for k in self.dict]))
 
     def coeffv(self, scalar):
         """Vector coefficient of a scalar
@@ -626,7 +605,7 @@ class Vector(Basic):
                             vcp[uv_term] = (vcp.get(uv_term, 0) +
                                     self.dict[k]*other.dict[ko]*
                                     kcrossko.dict[uv_term])
-            return Vector(vcp)
+            return Vector.trusted(vcp)
         elif isinstance(other, UnitVector):
             vcp = {}
             for k in self.dict:
@@ -638,7 +617,7 @@ class Vector(Basic):
                     for uv_term in k_cross_other.dict:
                         vcp[uv_term] = (vcp.get(uv_term, 0) +
                             self.dict[k]*k_cross_other.dict[uv_term])
-            return Vector(vcp)
+            return Vector.trusted(vcp)
         elif isinstance(other, (Add, Mul)):
             return self.cross(Vector(other))
         else:
@@ -682,41 +661,67 @@ class Vector(Basic):
                 if dt_self.values()[0] == 1:
                     return dt_self.keys()[0]        # Return a UnitVector
                 else:
-                    return Vector(dt_self)
+                    return Vector.trusted(dt_self)
             else:
-                return Vector(dt_self)
+                return Vector.trusted(dt_self)
 
     def express(self, frame):
         """Expresses a Vector with UnitVectors fixed in the specified frame.
+
+        The measure numbers are grouped into one block per frame (see
+        frame_blocks()), and each block is converted with a single product by
+        the direction cosine matrix between its frame and frame.
         """
 
         new = {}
 
-        for uv in self.dict.keys():
-            # Convert each unit vector term to the desired frame
-            uv_in_frame = uv.express(frame)
-
-            # Case for UnitVectors
-            if isinstance(uv_in_frame, UnitVector):
-                new[uv_in_frame] = new.get(uv_in_frame, 0) + self.dict[uv]
-
-            # Case for Vectors
-            elif isinstance(uv_in_frame, Vector):
-                # Go through each term
-                for uv_term, coef in uv_in_frame.dict.items():
-                    new[uv_term] = (new.get(uv_term, 0) +
-                            self.dict[uv]*coef)
+        for f, block in self.frame_blocks(frame).items():
+            if f is frame:
+                u = block
+            else:
+                u = f.get_dcm(frame)*Matrix(block)
+            for i in range(3):
+                if u[i] != 0:
+                    new[frame[i+1]] = new.get(frame[i+1], 0) + u[i]
 
+        nrf = frame.NewtonianReferenceFrame
+        cache = nrf.express_cache
         for uv in new.keys():
-            new[uv] = new[uv].expand().subs(uv.frame.NewtonianReferenceFrame.csqrd_dict).expand()
+            key = (id(nrf.csqrd_dict), new[uv])
+            c = cache.get(key)
+            if c is None:
+                c = new[uv].expand().subs(nrf.csqrd_dict).expand()
+                cache[key] = c
+            new[uv] = c
             #new[uv] = expand(trigsimp(new[uv]))
             #new[uv] = trigsimp(expand(trigsimp(new[uv])))
-            if new[uv] == 0: new.pop(uv)
 
-        if len(new) == 1 and new.values()[0] == 1:
-            return new.keys()[0]
+        vec = Vector.trusted(new)
+        if len(vec.dict) == 1 and vec.dict.values()[0] == 1:
+            return vec.dict.keys()[0]
         else:
-            return Vector(new)
+            return vec
+
+    def frame_blocks(self, frame=None):
+        """Groups the measure numbers of a Vector by frame.
+
+        Returns a dictionary whose keys are frames and whose values are lists
+        of the 3 measure numbers along the 1, 2 and 3 UnitVectors of that
+        frame.  If frame is given, UnitVectors which are fixed in more than
+        one frame are assigned to the one closest to frame.
+        """
+        blocks = {}
+        for uv, c in self.dict.items():
+            if frame is None:
+                f = uv.frame
+            else:
+                f = uv.nearest_frame(frame)
+            if f in blocks:
+                blocks[f][uv.i-1] += c
+            else:
+                blocks[f] = [0, 0, 0]
+                blocks[f][uv.i-1] = c
+        return blocks
 
     @property
     def mag(self):
@@ -860,11 +865,18 @@ class Vector(Basic):
 
     def partials(self, u_list):
         """Computes partial velocities.
+
+        The coefficient of every element of u_list is extracted from each
+        measure number in a single pass with linear_coefficients().
         """
-        return [self.coeffv(u) for u in u_list]
+        pv = [{} for u in u_list]
+        for uv, c in self.dict.items():
+            for d, c_u in zip(pv, linear_coefficients(c, u_list)):
+                d[uv] = c_u
+        return [Vector.trusted(d) for d in pv]
 
     def subs(self, subs_dict):
-        return Vector(dict([(k, self.dict[k].subs(subs_dict)) for k in
+        return Vector.trusted(dict([(k, self.dict[k].subs(subs_dict)) for k in
             self.dict]))
 
     def expandv(self):
@@ -873,7 +885,7 @@ class Vector(Basic):
         ex = {}
         for uv, c in self.dict.items():
             ex[uv] = c.expand()
-        return Vector(ex)
+        return Vector.trusted(ex)
 
 class Point(object):
     """
@@ -911,12 +923,16 @@ class Point(object):
             self.point_list = [self]
             self.pos = {self: Vector(0)}
             self._vrel = Vector(0)
+            # Paths between points of this tree, keyed by (from, to) points
+            self.point_paths = {}
             self.NewtonianFrame = fixedinframe
             self._fixedin = set([fixedinframe])
             self.parentpoint = None
             self.children = []
             self.mass = 0
             self.force = Vector(0)
+            self._abs_vel = self._abs_acc = None
+            self._abs_vel_user = self._abs_acc_user = False
         # When instantiated by locate method
         elif all([name, relativeposition, parentpoint]):
             relativeposition = Vector(relativeposition)
@@ -951,9 +967,72 @@ class Point(object):
                 self._vrel = relativeposition.dt(self.NewtonianFrame)
             else:
                 raise TypeError('fixedinframe must be a ReferenceFrame type')
+            self._abs_vel = self._abs_acc = None
+            self._abs_vel_user = self._abs_acc_user = False
         else:
             raise NotImplementedError()
 
+    def _invalidate_abs(self, recursive=True):
+        """Forgets whichever of the absolute velocity and acceleration of self
+        (and, if recursive, of the points located from it) were computed
+        rather than assigned.
+        """
+        if not self._abs_vel_user:
+            self._abs_vel = None
+        if not self._abs_acc_user:
+            self._abs_acc = None
+        if recursive:
+            for child in self.children:
+                child._invalidate_abs()
+
+    def _get_abs_vel(self):
+        if self._abs_vel is None:
+            if self.parentpoint is None:
+                self._abs_vel = self._vrel
+            else:
+                self._abs_vel = self.parentpoint.abs_vel + self._vrel
+        return self._abs_vel
+
+    def _set_abs_vel(self, v):
+        self._abs_vel = v
+        self._abs_vel_user = True
+        if not self._abs_acc_user:
+            self._abs_acc = None
+        for child in self.children:
+            child._invalidate_abs()
+
+    abs_vel = property(_get_abs_vel, _set_abs_vel, doc="""
+        Velocity of the point in the Newtonian frame.
+
+        Unless assigned, it is formed the first time it is needed from the
+        velocity of the parent point plus the velocity relative to it, and
+        remembered until recursive_subs() or an assignment upstream changes
+        it.  Assigning it, typically to an expression in the generalized
+        speeds, overrides the computed value for this point and those
+        located from it.""")
+
+    def _get_abs_acc(self):
+        if self._abs_acc is None:
+            N = self.NewtonianFrame
+            if self._abs_vel_user or self.parentpoint is None:
+                self._abs_acc = dt(self.abs_vel, N)
+            else:
+                self._abs_acc = self.parentpoint.abs_acc + dt(self._vrel, N)
+        return self._abs_acc
+
+    def _set_abs_acc(self, a):
+        self._abs_acc = a
+        self._abs_acc_user = True
+        for child in self.children:
+            child._invalidate_abs()
+
+    abs_acc = property(_get_abs_acc, _set_abs_acc, doc="""
+        Acceleration of the point in the Newtonian frame.
+
+        Unless assigned, it is the time derivative in the Newtonian frame of
+        an assigned abs_vel, or else the acceleration of the parent point
+        plus the time derivative of the velocity relative to it.""")
+
     def apply_force(self, force, other=None, reset=False):
         """Apply force to a point or particle.
 
@@ -1022,7 +1101,7 @@ class Point(object):
         of self relative to other.
         """
         if isinstance(other, Point):
-            pl = self.get_point_list(other)
+            pl = self.get_point_path(other)
             pos = Vector(0)
             for i, p in enumerate(pl[:-1]):
                 pos -= pl[i].pos[pl[i+1]]
@@ -1043,24 +1122,20 @@ class Point(object):
 
         v = Vector(0)
         if point == frame == None:
-            if hasattr(self, 'abs_vel'):
-                return self.abs_vel
-            else:
-                for p in self.point_list:
-                    v += p._vrel
+            return self.abs_vel
         elif isinstance(point, Point) and isinstance(frame, ReferenceFrame):
             # Get the point list from point to self
-            point_list = point.get_point_list(self)
+            point_list = point.get_point_path(self)
             for i, pa in enumerate(point_list[:-1]):
                 pb = point_list[i+1]
                 set_intersect = pa._fixedin & pb._fixedin
                 # Case when the two points are not fixed in the same frame
                 if len(set_intersect) == 0:
-                    v += dt(pb.rel(pa), frame)
+                    v += dt(pa.pos[pb], frame)
                 # Case when the two points are fixed in the same frame
                 elif len(set_intersect) == 1:
                     v += cross(set_intersect.pop().ang_vel(frame),
-                            pb.rel(pa))
+                            pa.pos[pb])
                 else:
                     raise NotImplementedError('Somehow these two points are \
                         both fixed in 2 or more of the same frames')
@@ -1072,27 +1147,24 @@ class Point(object):
         """
         if other == None:
             return self.point_list
-        elif self == other:
-            return [self]
         else:
-            r2t = list(reversed(other.point_list))
+            return list(self.get_point_path(other))
 
-            if len(self.point_list) == 1:
-                return r2t
-            elif len(r2t) == 1:
-                return self.point_list
-
-            r1t = list(reversed(self.point_list))
-            i = 1
-
-            while r1t[i] == r2t[i]:
-                del r1t[i-1]
-                del r2t[i-1]
-                if len(r1t)<2 or len(r2t)<2:
-                    break
+    def get_point_path(self, other):
+        """
+        Returns a tuple of the Points between Point self and Point other,
+        including both.
 
-            r1t.reverse()
-            return r1t[:-1] + r2t
+        Paths are cached on the root Point of the tree, so repeated queries
+        for the same pair of Points do not walk the tree again.
+        """
+        paths = self.point_list[-1].point_paths
+        try:
+            return paths[(self, other)]
+        except KeyError:
+            path = tree_path(self.point_list, other.point_list)
+            paths[(self, other)] = path
+            return path
 
     def __str__(self):
         return '<Point %s>' % self.name
@@ -1121,6 +1193,9 @@ class ReferenceFrame(object):
     determines how the basis UnitVectors are printed.
     """
 
+    # Source of the integer ids which key the UnitVectors of each frame
+    _frame_ids = count()
+
     def __init__(self, s, matrix=None, frame=None, omega=None):
         """
         If instantiated without the optional arguments, the 'base'
@@ -1131,6 +1206,7 @@ class ReferenceFrame(object):
         """
         self.children = []
         self.name = s
+        self.frame_id = self._frame_ids.next()
         self.triad = [UnitVector(self, i) for i in (1,2,3)]
         self.transforms = {}
         self.parentframe = frame
@@ -1143,6 +1219,18 @@ class ReferenceFrame(object):
             self.NewtonianReferenceFrame = self
             self.uv_dot_products = {}
             self.uv_cross_products = {}
+            # Composed direction cosine matrices, keyed by (from, to) frames
+            self.dcm_cache = {}
+            self.dcm_cache_hits = 0
+            self.dcm_cache_misses = 0
+            # Paths between frames of this tree, keyed by (from, to) frames
+            self.frame_paths = {}
+            # How coefficients of UnitVector cross products are simplified
+            self.simplification = 'csqrd'
+            self.simplify_cache = {}
+            self.csqrd_dict = {}
+            # Coefficients simplified by Vector.express
+            self.express_cache = LRUCache(10000)
             self.inertia = Inertia(self, (0,0,0,0,0,0))
         else:
             self.ref_frame_list = [self] + frame.ref_frame_list[:]
@@ -1160,7 +1248,8 @@ class ReferenceFrame(object):
             self._wrel = Vector(0)
 
         self._wrel_children = {}
-
+        self._abs_ang_vel = self._abs_ang_acc = None
+        self._abs_ang_vel_user = self._abs_ang_acc_user = False
 
         if frame is not None:
             frame.children.append(self)
@@ -1188,6 +1277,10 @@ class ReferenceFrame(object):
         """
         # We just append it to our "transforms" dict.
         self.transforms[frame] = matrix
+        # Any composed matrix may have passed through this edge
+        self.NewtonianReferenceFrame.dcm_cache.clear()
+        self.NewtonianReferenceFrame.uv_dot_products.clear()
+        self.NewtonianReferenceFrame.uv_cross_products.clear()
 
     def rotate(self, name, axis, angle, I=None, I_frame=None):
         """Returns a new rotated reference frame.
@@ -1332,26 +1425,23 @@ class ReferenceFrame(object):
         C.get_frames_list(F) == [C, B, A, D, E, F]
         F.get_frames_list(C) == [F, E, D, A, B, C]
         """
-        if self == frame:
-            return [self]
-        else:
-            r2t = list(reversed(frame.ref_frame_list))
-
-            if len(self.ref_frame_list) == 1:
-                return r2t
-            elif len(r2t) == 1:
-                return self.ref_frame_list
-
-            r1t = list(reversed(self.ref_frame_list))
-            i = 1
-            while r1t[i] == r2t[i]:
-                del r1t[i-1]
-                del r2t[i-1]
-                if len(r1t)<2 or len(r2t)<2:
-                    break
+        return list(self.get_frames_path(frame))
 
-            r1t.reverse()
-            return r1t[:-1] + r2t
+    def get_frames_path(self, frame):
+        """
+        Returns a tuple of frames from "self" to "frame", including both.
+
+        Same as get_frames_list(), but the tuple is cached on the Newtonian
+        frame, so repeated queries for the same pair of frames do not walk
+        the tree again.
+        """
+        paths = self.NewtonianReferenceFrame.frame_paths
+        try:
+            return paths[(self, frame)]
+        except KeyError:
+            path = tree_path(self.ref_frame_list, frame.ref_frame_list)
+            paths[(self, frame)] = path
+            return path
 
     def apply_torque(self, torque, other=None, reset=False):
         """Apply torque to a reference frame or rigid body.
@@ -1416,8 +1506,8 @@ class ReferenceFrame(object):
                 new_list.append(rm)
         """
 
-        frames = self.get_frames_list(frame)
-        if frames == [self]:
+        frames = self.get_frames_path(frame)
+        if len(frames) == 1:
             return [eye(3)]
         result = []
         for i, f in enumerate(frames[:-1]):
@@ -1425,11 +1515,195 @@ class ReferenceFrame(object):
         result.reverse()
         return result
 
+    def get_dcm(self, frame):
+        """
+        Returns the direction cosine matrix which maps the measure numbers of
+        a vector expressed in the basis vectors of self to the measure numbers
+        of that vector expressed in the basis vectors of frame.
+
+        The product of the matrices returned by get_rot_matrices() is formed
+        once per pair of frames and cached on the Newtonian frame; the cache
+        is cleared whenever a transform is appended to the tree.
+        """
+        nrf = self.NewtonianReferenceFrame
+        if (self, frame) in nrf.dcm_cache:
+            nrf.dcm_cache_hits += 1
+            return nrf.dcm_cache[(self, frame)]
+        nrf.dcm_cache_misses += 1
+        matrices = self.get_rot_matrices(frame)
+        C = matrices[0]
+        for m in matrices[1:]:
+            C = C*m
+        nrf.dcm_cache[(self, frame)] = C
+        # Direction cosine matrices are orthogonal
+        nrf.dcm_cache[(frame, self)] = C.T
+        return C
+
+    def compute_uv_products(self, frame):
+        """Fills the UnitVector dot and cross product tables of the Newtonian
+        frame for every pair (self[i], frame[j]).
+
+        All 9 dot products are the entries of the single direction cosine
+        matrix between the two frames, and all 9 cross products are formed
+        from those entries, in the basis vectors of self and in those of
+        frame.  The shorter of the two, after simplify(), is kept, with a
+        single unit term returned as a UnitVector.
+        """
+        nrf = self.NewtonianReferenceFrame
+        # D[i, j] = self[i] . frame[j]
+        D = frame.get_dcm(self)
+        for i in (1, 2, 3):
+            for j in (1, 2, 3):
+                nrf.uv_dot_products[(self[i], frame[j])] = D[i-1, j-1]
+                nrf.uv_dot_products[(frame[j], self[i])] = D[i-1, j-1]
+
+        def cross_terms(a, b, basis):
+            # Measure numbers in basis of (sum_k a[k]*e_k) x (sum_k b[k]*e_k)
+            cp = [a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2],
+                    a[0]*b[1] - a[1]*b[0]]
+            return dict([(basis[k+1], c) for k, c in enumerate(cp) if c != 0])
+
+        def as_result(cp):
+            if len(cp) == 1 and cp.values()[0] == 1:
+                return cp.keys()[0]
+            return Vector.trusted(cp)
+
+        for i in (1, 2, 3):
+            for j in (1, 2, 3):
+                # self[i] in basis of self, frame[j] in basis of self
+                cp1 = cross_terms([int(k == i) for k in (1, 2, 3)],
+                        D[:, j-1], self)
+                if len(cp1) <= 1 or self == frame:
+                    nrf.uv_cross_products[(self[i], frame[j])] = as_result(cp1)
+                    continue
+                # self[i] in basis of frame, frame[j] in basis of frame
+                cp2 = cross_terms(D[i-1, :], [int(k == j) for k in (1, 2, 3)],
+                        frame)
+                if len(cp2) == 1 and cp2.values()[0] == 1:
+                    cp = cp2
+                else:
+                    for cp in (cp1, cp2):
+                        for k in cp.keys():
+                            cp[k] = nrf.simplify(cp[k])
+                            if cp[k] == 0:
+                                del cp[k]
+                    if len(cp2) < len(cp1) or (len(cp2) == 1 and
+                            cp2.values()[0] == 1):
+                        cp = cp2
+                    else:
+                        cp = cp1
+                nrf.uv_cross_products[(self[i], frame[j])] = as_result(cp)
+
+    def set_simplification(self, policy):
+        """Sets how simplify() treats coefficients of UnitVector cross
+        products for the whole tree of frames.
+
+        'none' leaves them as they are, 'csqrd' expands them and replaces
+        cos(q)**2 by 1 - sin(q)**2 for each generalized coordinate q, and
+        'trigsimp' calls trigsimp on them.  The default is 'csqrd'.
+        """
+        if policy not in ('none', 'csqrd', 'trigsimp'):
+            raise ValueError("policy must be 'none', 'csqrd' or 'trigsimp'")
+        nrf = self.NewtonianReferenceFrame
+        nrf.simplification = policy
+        nrf.simplify_cache.clear()
+        # Cross products already stored were simplified under the old policy
+        nrf.uv_cross_products.clear()
+
+    def simplify(self, expr):
+        """Simplifies expr according to the policy chosen with
+        set_simplification(), reusing earlier results for the same expr.
+        """
+        nrf = self.NewtonianReferenceFrame
+        try:
+            return nrf.simplify_cache[expr]
+        except KeyError:
+            pass
+        if nrf.simplification == 'csqrd':
+            result = expr.expand().subs(nrf.csqrd_dict).expand()
+        elif nrf.simplification == 'trigsimp':
+            result = trigsimp(expr)
+        else:
+            result = expr
+        nrf.simplify_cache[expr] = result
+        return result
+
+    def dcm_cache_info(self):
+        """Returns a dictionary with the number of hits, misses, and stored
+        matrices of the direction cosine matrix cache.
+        """
+        nrf = self.NewtonianReferenceFrame
+        return {'hits': nrf.dcm_cache_hits, 'misses': nrf.dcm_cache_misses,
+                'size': len(nrf.dcm_cache)}
+
+    def _invalidate_abs(self, recursive=True):
+        """Forgets whichever of the absolute angular velocity and angular
+        acceleration of self (and, if recursive, of the frames rotated from
+        it) were computed rather than assigned.
+        """
+        if not self._abs_ang_vel_user:
+            self._abs_ang_vel = None
+        if not self._abs_ang_acc_user:
+            self._abs_ang_acc = None
+        if recursive:
+            for child in self.children:
+                child._invalidate_abs()
+
+    def _get_abs_ang_vel(self):
+        if self._abs_ang_vel is None:
+            if self.parentframe is None:
+                self._abs_ang_vel = self._wrel
+            else:
+                self._abs_ang_vel = self.parentframe.abs_ang_vel + self._wrel
+        return self._abs_ang_vel
+
+    def _set_abs_ang_vel(self, w):
+        self._abs_ang_vel = w
+        self._abs_ang_vel_user = True
+        if not self._abs_ang_acc_user:
+            self._abs_ang_acc = None
+        for child in self.children:
+            child._invalidate_abs()
+
+    abs_ang_vel = property(_get_abs_ang_vel, _set_abs_ang_vel, doc="""
+        Angular velocity of the frame in the Newtonian frame.
+
+        Unless assigned, it is formed the first time it is needed from the
+        angular velocity of the parent frame plus the angular velocity
+        relative to it, and remembered until set_omega(), recursive_subs()
+        or an assignment upstream changes it.  Assigning it overrides the
+        computed value for this frame and those rotated from it.""")
+
+    def _get_abs_ang_acc(self):
+        if self._abs_ang_acc is None:
+            N = self.NewtonianReferenceFrame
+            if self._abs_ang_vel_user or self.parentframe is None:
+                self._abs_ang_acc = dt(self.abs_ang_vel, N)
+            else:
+                self._abs_ang_acc = (self.parentframe.abs_ang_acc +
+                        dt(self._wrel, N))
+        return self._abs_ang_acc
+
+    def _set_abs_ang_acc(self, alpha):
+        self._abs_ang_acc = alpha
+        self._abs_ang_acc_user = True
+        for child in self.children:
+            child._invalidate_abs()
+
+    abs_ang_acc = property(_get_abs_ang_acc, _set_abs_ang_acc, doc="""
+        Angular acceleration of the frame in the Newtonian frame.
+
+        Unless assigned, it is the time derivative in the Newtonian frame of
+        an assigned abs_ang_vel, or else the angular acceleration of the
+        parent frame plus the time derivative of the angular velocity
+        relative to it.""")
+
     def set_omega(self, omega, frame, force=False):
         """Sets the angular velocity relative to another frame.
         """
         if self._wrel == Vector(0) or force:
             self._wrel = omega
+            self._invalidate_abs()
         #if self.W == {} or force:
         #    self.W[frame] = omega
         else:
@@ -1441,18 +1715,11 @@ class ReferenceFrame(object):
 
         if frame == self:
             return Vector(0)
+        elif frame == None or frame == self.NewtonianReferenceFrame:
+            return self.abs_ang_vel
         else:
-            if frame == None:
-                if hasattr(self, 'abs_ang_vel'):
-                    return self.abs_ang_vel
-                else:
-                    frame = self.NewtonianReferenceFrame
-            elif frame == self.NewtonianReferenceFrame and hasattr(self,
-                'abs_ang_vel'):
-                return self.abs_ang_vel
-
             om = Vector(0)
-            fl = frame.get_frames_list(self)
+            fl = frame.get_frames_path(self)
             n = len(fl)
             for i, f in enumerate(fl[:-1]):
                 if f == fl[i+1].parentframe:
@@ -1467,27 +1734,17 @@ class ReferenceFrame(object):
 
         if frame == self:
             return Vector(0)
+        elif frame == None or frame == self.NewtonianReferenceFrame:
+            return self.abs_ang_acc
         else:
-            if frame == None: frame = self.NewtonianReferenceFrame
-            if hasattr(self, 'abs_ang_acc'):
-                return self.abs_ang_acc
-            else:
-                alpha = Vector(0)
-                fl = frame.get_frames_list(self)
-                n = len(fl)
-                for i, f in enumerate(fl[:-1]):
-                    if f == fl[i+1].parentframe:
-                        alpha += fl[i+1]._alpharel
-                    else:
-                        alpha -= fl[i]._alpharel
-            return alpha
+            return dt(self.ang_vel(frame), frame)
 
     def get_omega_list(self, frame):
         """
         Returns a list of simple angular velocities from self to frame.
         """
-        frames = self.get_frames_list(frame)
-        if frames == [self]:
+        frames = self.get_frames_path(frame)
+        if len(frames) == 1:
             return [Vector({})]
         result = []
         for i, f in enumerate(frames[:-1]):
@@ -1529,6 +1786,23 @@ class NewtonianReferenceFrame(ReferenceFrame):
         self.csqrd_dict = {}
         self.crossterms = set([])
 
+    def set_express_cache_size(self, maxsize):
+        """Sets how many simplified coefficients Vector.express remembers;
+        0 disables the cache.
+        """
+        self.express_cache.resize(maxsize)
+
+    def express_cache_info(self):
+        """Returns a dictionary with the hits, misses, hit rate, size and
+        maximum size of the cache of coefficients simplified by
+        Vector.express.
+        """
+        return self.express_cache.info()
+
+    def clear_express_cache(self):
+        """Forgets all coefficients simplified by Vector.express."""
+        self.express_cache.clear()
+
     def setkindiffs(self, eqn_list):#, dependent_speeds=None, acc=True):
         """Set the kinematic differential equations of the system.
 
@@ -1548,8 +1822,11 @@ class NewtonianReferenceFrame(ReferenceFrame):
         # Substitute into appropriate velocity/angular velocity
         if isinstance(PorF, Point):
             PorF._vrel = PorF._vrel.subs(expr_dict)
+            # The children are visited below
+            PorF._invalidate_abs(recursive=False)
         elif isinstance(PorF, ReferenceFrame):
             PorF._wrel = PorF._wrel.subs(expr_dict)
+            PorF._invalidate_abs(recursive=False)
         else:
             raise NotImplementedError()
 
@@ -1564,6 +1841,19 @@ class NewtonianReferenceFrame(ReferenceFrame):
         """Recursively form the relative partial velocities of each point and
         partial angular velocity of each reference frame.
         """
+        self.body_partials(PorF)
+
+        #  Initiate recursion
+        if PorF.children == []:
+            return
+        else:
+            for child in PorF.children:
+                self.recursive_partials(child)
+
+    def body_partials(self, PorF):
+        """Form the partial velocities of a point, or the partial angular
+        velocities of a reference frame.
+        """
         # Substitute into appropriate velocity/angular velocity
         if isinstance(PorF, (Point, ReferenceFrame)):
             if isinstance(PorF, Point): pv = PorF.vel().partials(self.u_list)
@@ -1582,13 +1872,6 @@ class NewtonianReferenceFrame(ReferenceFrame):
         else:
             raise NotImplementedError
 
-        #  Initiate recursion
-        if PorF.children == []:
-            return
-        else:
-            for child in PorF.children:
-                self.recursive_partials(child)
-
     def declare_coords(self, string, number, list=True):
         """Declare the generalized coordinates and their time derivatives.
         """
@@ -1597,6 +1880,8 @@ class NewtonianReferenceFrame(ReferenceFrame):
         self.qdot_list = qdot_list
         # Generate lists of Symbol objects instead of Function objects
         self.csqrd_dict = {}
+        self.simplify_cache.clear()
+        self.express_cache.clear()
         self.tan_dict = {}
         self.cot_dict = {}
         for q in q_list:
@@ -1733,9 +2018,63 @@ class NewtonianReferenceFrame(ReferenceFrame):
         self.recursive_frstar(self.O, subs_dict=subs_dict)
         self.recursive_frstar(self, subs_dict=subs_dict)
 
+    def is_gyroscopic(self, mono):
+        """Returns True if mono is a product of two generalized speeds or
+        coordinate time derivatives, e.g. u1*u2, u1*q2' or u1**2.
+        """
+        degree = 0
+        for f in Mul.make_args(mono):
+            if f.is_Pow:
+                f, e = f.base, f.exp
+            else:
+                e = 1
+            if f not in self.u_list and f not in self.qdot_list:
+                return False
+            degree += e
+        return degree == 2
+
     def recursive_frstar(self, PorF, subs_dict=None):
         """Recursively computes generalized inertia forces for each particle
         and rigid body in the system.
+        """
+        self.body_frstar(PorF, subs_dict=subs_dict)
+
+        #  Initiate recursion
+        if PorF.children == []:
+            return
+        else:
+            for child in PorF.children:
+                self.recursive_frstar(child, subs_dict=subs_dict)
+
+    def body_frstar(self, PorF, subs_dict=None):
+        """Computes the generalized inertia forces of a particle or rigid body,
+        adding its contribution to the mass matrix.
+        """
+        p = len(self.u_independent)
+        if not self.body_has_inertia(PorF):
+            PorF.gen_inertia_force = [(0, 0)] * p
+        else:
+            self.inertia_terms(PorF, subs_dict=subs_dict)
+            PorF.gen_inertia_force = []
+            # Loop through all partial velocities / partial angular velocites
+            for i in range(len(PorF.partialv)):
+                mm_row, gif = self.frstar_row(PorF, i)
+                self.mass_matrix[i, :] += mm_row
+                PorF.gen_inertia_force.append(gif)
+
+    def body_has_inertia(self, PorF):
+        """Returns False for a massless point or a reference frame without
+        inertia, whose generalized inertia forces are all zero.
+        """
+        assert isinstance(PorF, (ReferenceFrame, Point))
+        if isinstance(PorF, Point):
+            return PorF.mass != 0
+        else:
+            return PorF.inertia.dict != {}
+
+    def inertia_terms(self, PorF, subs_dict=None):
+        """Collects the inertia force of a particle or rigid body by the terms
+        it is linear in.
 
         Generalized inertia forces will be linear in the time derivatives of
         the generalized speeds and the gyroscopic terms of the form u_j*u_k.
@@ -1743,90 +2082,89 @@ class NewtonianReferenceFrame(ReferenceFrame):
         to collect all like terms, so that simplifications on each of the
         coefficients of these linear terms can be simplified individually.
 
-        We store these coefficients as a Matrix of length: n + (n**2+n)/2.
-        Where n is the number of generalized speeds (both dependent and
-        independent).  The (n**2 + n)/2 comes from the numer of unique possible
-        gyroscopic terms.  The coefficients are ordered from u1,..., un, while
-        the gyroscopic terms are ordered according to the ordering of the
-        "crossterms" attribute.
+        The Vector coefficients of the n time derivatives of the generalized
+        speeds are stored in order in the "udot_coefficients" list of PorF.
+        The gyroscopic terms, products of two of the generalized speeds and
+        coordinate time derivatives, are collected sparsely: only the
+        products which appear in the inertia force of PorF are found, and
+        they are stored with their Vector coefficients in the
+        "gyroscopic_terms" dictionary of PorF.
+        """
+        # The acceleration of every point is linear in the d(u_i)/dt and in
+        # the products u_i * u_j, u_i * qd_j and qd_i * qd_j
+        atoms = set(self.udot_list + self.u_list + self.qdot_list)
+        # Compute the generalized inertia forces
+        if isinstance(PorF, Point):
+            acc = PorF.abs_acc
+            inertia_force = {}
+            for k, v in acc.dict.items():
+                inertia_force[k] = -PorF.mass * v
+            inertia_force = Vector(inertia_force).expandv()
+        else:
+            alph = PorF.ang_acc()
+            I = PorF.inertia
+            w = PorF.ang_vel()
+            #inertia_force = (-alph.dot(I)-w.cross(I.rdot(w))).expandv()
+            inertia_force = (-dot(I, alph) - cross(w, dot(I, w))).expandv()
+
+        # If subs_dict was passed to form_kanes_equations, substitute it
+        # here:
+        if subs_dict:
+            inertia_force = inertia_force.subs(subs_dict)
+        # Coefficients of every monomial present, keyed by monomial, then
+        # by UnitVector
+        terms = {}
+        for uv, c in inertia_force.dict.items():
+            for mono, coef in monomial_coefficients(c, atoms).items():
+                terms.setdefault(mono, {})[uv] = coef
+        PorF.udot_coefficients = [Vector.trusted(terms.pop(ud, {})) for ud in
+                self.udot_list]
+        PorF.gyroscopic_terms = {}
+        for mono, d in terms.items():
+            if self.is_gyroscopic(mono):
+                PorF.gyroscopic_terms[mono] = Vector.trusted(d)
+
+    def frstar_row(self, PorF, i):
+        """Returns the contribution of a particle or rigid body to row i of the
+        mass matrix, and its i-th generalized inertia force as the tuple
+        (terms in the udots, gyroscopic terms).
+
+        inertia_terms() must have been called for PorF.
         """
-        # List of d(u_i)/dt, u_i * u_j, and u_i * qd_j terms.  The acceleration
-        # of every point is linear in all these terms.
-        udgyro_list = self.udot_list + self.crossterms
         n = len(self.udot_list)
         m = len(self.u_dependent)
         p = len(self.u_independent)
-        assert isinstance(PorF, (ReferenceFrame, Point))
-        if isinstance(PorF, Point) and PorF.mass == 0:
-            PorF.gen_inertia_force = [(0, 0)] * p
-        elif isinstance(PorF, ReferenceFrame) and PorF.inertia.dict == {}:
-            PorF.gen_inertia_force = [(0, 0)] * p
-        else:
-            PorF.gen_inertia_force = []
-            # Compute the generalized inertia forces
-            if isinstance(PorF, Point):
-                acc = PorF.abs_acc
-                inertia_force = {}
-                for k, v in acc.dict.items():
-                    inertia_force[k] = -PorF.mass * v
-                inertia_force = Vector(inertia_force).expandv()
-            else:
-                alph = PorF.ang_acc()
-                I = PorF.inertia
-                w = PorF.ang_vel()
-                #inertia_force = (-alph.dot(I)-w.cross(I.rdot(w))).expandv()
-                inertia_force = (-dot(I, alph) - cross(w, dot(I, w))).expandv()
-
-            # If subs_dict was passed to form_kanes_equations, substitute it
-            # here:
-            if subs_dict:
-                inertia_force = inertia_force.subs(subs_dict)
-            # List of coefficients of all linear terms
-            coef_list = inertia_force.partials(udgyro_list)
-            # Loop through all partial velocities / partial angular velocites
-            for i, pv in enumerate(PorF.partialv):
-                sum_ud = 0
-                sum_gyro = 0
-                coef_list_d_pv = []
-                for c in coef_list:
-                    coef_list_d_pv.append(c.dot(pv))
-                if n == p:  # Case for no motion constraints
-                    for j, udot in enumerate(udgyro_list[:p]):
-                        self.mass_matrix[i, j] += coef_list_d_pv[j]
-                        sum_ud += coef_list_d_pv[j] * udot
-                    for j, gyro in enumerate(udgyro_list[p:]):
-                        sum_gyro += coef_list_d_pv[j+p] * gyro
-                    PorF.gen_inertia_force.append((sum_ud, sum_gyro))
-                else:       # Case for systems with motion constraints
-                    mm_row = zeros((1, p+m))
-                    mm_i_row = zeros((1, p))
-                    mm_d_row = zeros((1, m))
-                    for j in range(p):
-                        mm_row[j] += coef_list_d_pv[j]
-                    for j, jt in enumerate(self.dependent_ci):
-                        mm_d_row[j] = mm_row[jt]
-                    for j, jt in enumerate(self.independent_ci):
-                        mm_i_row[j] = mm_row[jt]
-
-                    # Normal gyroscopic terms that appear in GIF's
-                    for j, gyro in enumerate(udgyro_list[p:]):
-                        sum_gyro += coef_list_d_pv[j+p] * gyro
-                    # Extra gyroscopic terms that appear in GIF's due to
-                    # constraints
-                    sum_gyro += (mm_d_row * self.T_con_dt * Matrix(self.u_independent))[0]
-
-                    # Mass matrix, constrained
-                    mm_con = mm_i_row +  mm_d_row*self.T_con
-                    sum_ud = (mm_con * Matrix(self.udot_independent))[0]
-                    self.mass_matrix[i, :] += mm_con
-                    PorF.gen_inertia_force.append((sum_ud, sum_gyro))
-
-        #  Initiate recursion
-        if PorF.children == []:
-            return
-        else:
-            for child in PorF.children:
-                self.recursive_frstar(child, subs_dict=subs_dict)
+        pv = PorF.partialv[i]
+        sum_ud = 0
+        sum_gyro = 0
+        ud_coefs_d_pv = [c.dot(pv) for c in PorF.udot_coefficients]
+        for gyro, c in PorF.gyroscopic_terms.items():
+            sum_gyro += c.dot(pv) * gyro
+        if n == p:  # Case for no motion constraints
+            mm_row = zeros((1, p))
+            for j, udot in enumerate(self.udot_list[:p]):
+                mm_row[j] += ud_coefs_d_pv[j]
+                sum_ud += ud_coefs_d_pv[j] * udot
+            return mm_row, (sum_ud, sum_gyro)
+        else:       # Case for systems with motion constraints
+            mm_row = zeros((1, p+m))
+            mm_i_row = zeros((1, p))
+            mm_d_row = zeros((1, m))
+            for j in range(p):
+                mm_row[j] += ud_coefs_d_pv[j]
+            for j, jt in enumerate(self.dependent_ci):
+                mm_d_row[j] = mm_row[jt]
+            for j, jt in enumerate(self.independent_ci):
+                mm_i_row[j] = mm_row[jt]
+
+            # Extra gyroscopic terms that appear in GIF's due to
+            # constraints
+            sum_gyro += (mm_d_row * self.T_con_dt * Matrix(self.u_independent))[0]
+
+            # Mass matrix, constrained
+            mm_con = mm_i_row +  mm_d_row*self.T_con
+            sum_ud = (mm_con * Matrix(self.udot_independent))[0]
+            return mm_con, (sum_ud, sum_gyro)
 
     def fr(self):
         """Computes the generalized active forces of the system.
@@ -1838,20 +2176,7 @@ class NewtonianReferenceFrame(ReferenceFrame):
         """Recursively computes generalized active forces for each particle
         and rigid body in the system.
         """
-        if isinstance(PorF, Point):
-            if PorF.force == Vector(0):
-                PorF.gen_active_force = [0] * len(self.u_independent)
-            else:
-                PorF.gen_active_force = [PorF.force.dot(pv) for pv in
-                    PorF.partialv]
-        elif isinstance(PorF, ReferenceFrame):
-            if PorF.torque == Vector(0):
-                PorF.gen_active_force = [0] * len(self.u_independent)
-            else:
-                PorF.gen_active_force = [PorF.torque.dot(pw) for pw in
-                    PorF.partialv]
-        else:
-            raise NotImplementedError()
+        self.body_fr(PorF)
 
         #  Initiate recursion
         if PorF.children == []:
@@ -1860,6 +2185,27 @@ class NewtonianReferenceFrame(ReferenceFrame):
             for child in PorF.children:
                 self.recursive_fr(child)
 
+    def body_fr(self, PorF):
+        """Computes the generalized active forces of a particle or rigid body.
+        """
+        PorF.gen_active_force = [self.fr_row(PorF, i) for i in
+                range(len(self.u_independent))]
+
+    def fr_row(self, PorF, i):
+        """Returns the i-th generalized active force of a particle or rigid
+        body.
+        """
+        if isinstance(PorF, Point):
+            F = PorF.force
+        elif isinstance(PorF, ReferenceFrame):
+            F = PorF.torque
+        else:
+            raise NotImplementedError()
+        if F == Vector(0):
+            return 0
+        else:
+            return F.dot(PorF.partialv[i])
+
     def gravity(self, v):
         """Applies a gravitational force to each particle and rigid body in the
         system.
@@ -1882,7 +2228,8 @@ class NewtonianReferenceFrame(ReferenceFrame):
             for child in Point.children:
                 self.recursive_gravity(child, v)
 
-    def form_kanes_equations(self, subs_dict=None):
+    def form_kanes_equations(self, subs_dict=None, processes=None,
+            fan_out='body'):
         """Forms Kanes equations in a slightly modified form.
 
         Rather than returning:
@@ -1890,15 +2237,25 @@ class NewtonianReferenceFrame(ReferenceFrame):
 
         It returns a list of equations which have the udot's on the left hand
         side and everything else on the opposite side.
-        """
-        # Form Partial Velocities and Partial Angular velocities for every
-        # Point and Reference Frame
-        self.recursive_partials(self)
-        self.recursive_partials(self.O)
-        # Compute the generalized active forces
-        self.fr()
-        # Compute the generalized inertia forces
-        self.frstar(subs_dict=subs_dict)
+
+        If processes is given, the partial velocities and generalized active
+        and inertia forces of each particle and rigid body are computed in a
+        pool of that many worker processes, one body per task, or one body
+        and row of the equations per task if fan_out is 'row' (see
+        parallel_forces()).
+        """
+        if processes is None:
+            # Form Partial Velocities and Partial Angular velocities for
+            # every Point and Reference Frame
+            self.recursive_partials(self)
+            self.recursive_partials(self.O)
+            # Compute the generalized active forces
+            self.fr()
+            # Compute the generalized inertia forces
+            self.frstar(subs_dict=subs_dict)
+        else:
+            self.parallel_forces(subs_dict=subs_dict, processes=processes,
+                    fan_out=fan_out)
         p = len(self.u_independent)
         self.kanes_equations = []
         self.ke_lhs = [0] * p
@@ -1917,9 +2274,9 @@ class NewtonianReferenceFrame(ReferenceFrame):
                     s += c_ud * ud
             self.ke_lhs[i] = s
             s = S(0)
-            for uu in self.crossterms:
-                c_uu = self.ke_rhs_if[i].coeff(uu)
-                if c_uu is not None:
+            for uu, c_uu in monomial_coefficients(self.ke_rhs_if[i],
+                    set(self.u_list + self.qdot_list)).items():
+                if self.is_gyroscopic(uu) and c_uu != 0:
                     s += c_uu * uu
             self.ke_rhs_if[i] = s
             af = factor(self.ke_rhs_af[i].subs(self.trig_subs_dict).\
@@ -1929,21 +2286,344 @@ class NewtonianReferenceFrame(ReferenceFrame):
         self.kanes_equations = ke
         return ke
 
+    def tree_list(self, PorF):
+        """Returns PorF and all Points or ReferenceFrames descending from it,
+        in the order the recursive_* methods visit them.
+        """
+        result = [PorF]
+        for child in PorF.children:
+            result.extend(self.tree_list(child))
+        return result
+
+    def parallel_forces(self, subs_dict=None, processes=None,
+            fan_out='body'):
+        """Computes the partial velocities, generalized active forces and
+        generalized inertia forces of every particle and rigid body in a
+        multiprocessing pool of processes workers (all cores if None).
+
+        With fan_out='body' each task is one body.  With fan_out='row' the
+        work is done in two rounds: first the partial velocities and the
+        coefficients of the udots and gyroscopic terms of each body, then
+        one task per body and row of Kane's equations, forming that row of
+        the mass matrix and of the generalized forces.  The second round
+        keeps all cores busy when there are fewer bodies than cores.
+
+        The workers are forked from this process, so they see the whole
+        system as it is now; this requires a platform where multiprocessing
+        forks, i.e. not Windows.  Results are sent back with the generalized
+        coordinates, speeds and their derivatives replaced by the Symbols of
+        symbol_dict, and with UnitVectors replaced by (frame id, index)
+        pairs.  Contributions are summed in tree order, so the result does
+        not depend on which worker finished first.
+        """
+        if fan_out not in ('body', 'row'):
+            raise ValueError("fan_out must be 'body' or 'row'")
+        p = len(self.u_independent)
+        m = len(self.u_dependent)
+        bodies = self.tree_list(self.O) + self.tree_list(self)
+        frames = dict([(f.frame_id, f) for f in self.tree_list(self)])
+        self.mass_matrix = zeros((p, p))
+        if m != 0:
+            self.mass_matrix_i = zeros((p, p))
+            self.mass_matrix_d = zeros((p, m))
+
+        if fan_out == 'body':
+            results = self.pool_map(_kane_body_worker, range(len(bodies)),
+                    bodies, subs_dict, processes)
+            for PorF, (r, mm) in zip(bodies, results):
+                self.unpack_body(PorF, r, frames)
+                for i in range(p):
+                    for j in range(p):
+                        if mm[i][j] != 0:
+                            self.mass_matrix[i, j] += self.from_symbols(
+                                    mm[i][j])
+        else:
+            results = self.pool_map(_kane_inertia_worker,
+                    range(len(bodies)), bodies, subs_dict, processes)
+            for PorF, r in zip(bodies, results):
+                self.unpack_body(PorF, r, frames)
+            # The second round of workers is forked after the first round
+            # of results has been stored on the bodies
+            tasks = [(b, i) for b in range(len(bodies)) for i in range(p)]
+            results = self.pool_map(_kane_row_worker, tasks, bodies,
+                    subs_dict, processes)
+            for PorF in bodies:
+                PorF.gen_active_force = []
+                PorF.gen_inertia_force = []
+            for (b, i), (gaf, gif, mm_row) in zip(tasks, results):
+                PorF = bodies[b]
+                PorF.gen_active_force.append(self.from_symbols(gaf))
+                PorF.gen_inertia_force.append((self.from_symbols(gif[0]),
+                    self.from_symbols(gif[1])))
+                if mm_row is not None:
+                    for j in range(p):
+                        if mm_row[j] != 0:
+                            self.mass_matrix[i, j] += self.from_symbols(
+                                    mm_row[j])
+
+    def pool_map(self, func, tasks, bodies, subs_dict, processes):
+        """Returns [func(task) for task in tasks], evaluated in a pool of
+        forked worker processes which find the system, bodies and subs_dict
+        in _kane_system.
+        """
+        global _kane_system
+        _kane_system = (self, bodies, subs_dict)
+        try:
+            pool = multiprocessing.Pool(processes)
+            try:
+                return pool.map(func, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _kane_system = None
+
+    def to_symbols(self, expr):
+        """Replaces the generalized coordinates, speeds, and their time
+        derivatives in expr by the Symbols of symbol_dict.
+        """
+        expr = sympify(expr)
+        # Derivatives first, so that q(t) inside Derivative(q(t), t) is
+        # not replaced on its own
+        for d in (self.qdot_list_dict, self.udot_list_dict):
+            expr = expr.subs(d)
+        for d in (self.q_list_dict, self.u_list_dict):
+            expr = expr.subs(d)
+        return expr
+
+    def from_symbols(self, expr):
+        """Inverse of to_symbols()."""
+        return expr.subs(self.symbol_dict_back)
+
+    def pack_body(self, PorF, attrs):
+        """Returns the attributes named in attrs among partialv,
+        gen_active_force, gen_inertia_force, udot_coefficients and
+        gyroscopic_terms of PorF, in a picklable form.
+        """
+        r = {}
+        for a in attrs:
+            value = getattr(PorF, a)
+            if a in ('partialv', 'udot_coefficients'):
+                r[a] = [self.pack_vector(v) for v in value]
+            elif a == 'gen_active_force':
+                r[a] = [self.to_symbols(f) for f in value]
+            elif a == 'gen_inertia_force':
+                r[a] = [(self.to_symbols(ud), self.to_symbols(gyro)) for ud,
+                        gyro in value]
+            elif a == 'gyroscopic_terms':
+                r[a] = [(self.to_symbols(k), self.pack_vector(v)) for k, v in
+                        value.items()]
+            else:
+                raise ValueError('Cannot pack attribute %s' % a)
+        return r
+
+    def unpack_body(self, PorF, r, frames):
+        """Sets the attributes of PorF from the output of pack_body().
+        frames maps frame ids to ReferenceFrames.
+        """
+        for a, value in r.items():
+            if a in ('partialv', 'udot_coefficients'):
+                value = [self.unpack_vector(v, frames) for v in value]
+            elif a == 'gen_active_force':
+                value = [self.from_symbols(f) for f in value]
+            elif a == 'gen_inertia_force':
+                value = [(self.from_symbols(ud), self.from_symbols(gyro)) for
+                        ud, gyro in value]
+            elif a == 'gyroscopic_terms':
+                value = dict([(self.from_symbols(k),
+                    self.unpack_vector(v, frames)) for k, v in value])
+            setattr(PorF, a, value)
+
+    def pack_vector(self, v):
+        """Returns v as a list of (frame id, index, coefficient) triples, the
+        coefficients passed through to_symbols().
+        """
+        return [(uv.frame.frame_id, uv.i, self.to_symbols(c)) for uv, c in
+                Vector(v).dict.items()]
+
+    def unpack_vector(self, packed, frames):
+        """Inverse of pack_vector(); frames maps frame ids to
+        ReferenceFrames.
+        """
+        return Vector.trusted(dict([(frames[f][i], self.from_symbols(c)) for
+            f, i, c in packed]))
+
     def set_kanes_equations(self, eqns):
         self.kanes_equations = eqns
 
-    def solve_kanes_equations(self, dummy_vars=None):
+    # Derived results stored by save_eoms()
+    eom_attributes = ('kanes_equations', 'mass_matrix', 'mass_matrix_i',
+            'mass_matrix_d', 'ke_lhs', 'ke_rhs_if', 'ke_rhs_af', 'kindiffs',
+            'dyndiffs', 'dummy_dict')
+    # Part of model_hash(), to be changed whenever the files written by
+    # save_eoms() change
+    eom_cache_version = 2
+
+    def model_hash(self, extra=None):
+        """Returns a hash of the definition of the system: the frame and point
+        trees with their orientations, velocities and accelerations, masses,
+        inertias, forces and torques, the coordinates, speeds, constraints,
+        parameters and simplification policy.  It is the same in every run
+        for an unchanged model.
+
+        The arguments the equations were derived with, such as the subs_dict
+        of form_kanes_equations() or the method of solve_kanes_equations(),
+        are not part of the model; pass them as extra to include them.
+        """
+        def stable(x):
+            # An unambiguous string which doesn't depend on dictionary order;
+            # srepr() tells q1(t) and Symbol('q1') apart, which str() doesn't
+            if isinstance(x, (Vector, Dyad)):
+                x = x.dict
+            if isinstance(x, dict):
+                return '{' + ', '.join(sorted([stable(k) + ': ' + stable(v)
+                    for k, v in x.items()])) + '}'
+            if isinstance(x, (list, tuple)):
+                return '[' + ', '.join([stable(e) for e in x]) + ']'
+            if isinstance(x, Basic):
+                return srepr(x)
+            if isinstance(x, str):
+                return repr(x)
+            return '%s(%s)' % (type(x).__name__, x)
+        model = [('version', self.eom_cache_version)]
+        for F in self.tree_list(self):
+            parent = F.parentframe
+            model.append(('frame', F.name, parent and parent.name,
+                F.transforms.get(parent), getattr(F, '_wrel', None),
+                F.inertia, F.torque, F._abs_ang_vel_user and F._abs_ang_vel,
+                F._abs_ang_acc_user and F._abs_ang_acc))
+        for P in self.tree_list(self.O):
+            parent = P.parentpoint
+            model.append(('point', P.name, parent and parent.name,
+                parent and P.pos[parent], P._vrel, P.mass, P.force,
+                P._abs_vel_user and P._abs_vel, P._abs_acc_user and
+                P._abs_acc))
+        for a in ('q_list', 'u_list', 'u_dependent', 'parameter_list',
+                'hc_eqns', 'dhc_eqns', 'nhc_eqns', 'kindiffs'):
+            model.append((a, getattr(self, a, None)))
+        model.append(('simplification', self.simplification))
+        model.append(('extra', extra))
+        return sha1(stable(model)).hexdigest()
+
+    def pack_eoms(self, x):
+        """Returns x, which may be nested in lists, tuples, dicts and
+        Matrices, with to_symbols() applied to every expression.
+        """
+        if isinstance(x, Matrix):
+            return Matrix(x.rows, x.cols, lambda i, j: self.to_symbols(x[i,
+                j]))
+        if isinstance(x, dict):
+            return dict([(self.pack_eoms(k), self.pack_eoms(v)) for k, v in
+                x.items()])
+        if isinstance(x, (list, tuple)):
+            return type(x)([self.pack_eoms(e) for e in x])
+        if isinstance(x, Basic):
+            return self.to_symbols(x)
+        return x
+
+    def unpack_eoms(self, x, dummies=None):
+        """Inverse of pack_eoms().
+
+        Unpickled Dummy symbols keep the index they had in the run which
+        saved them, so they may equal Dummy symbols of this run.  They are
+        replaced by new ones, through dummies, which maps the unpickled
+        Dummy symbols to their replacements and should be shared by the
+        calls for the parts of one file.
+        """
+        if dummies is None:
+            dummies = {}
+        if isinstance(x, Matrix):
+            return x.applyfunc(lambda e: self.unpack_eoms(e, dummies))
+        if isinstance(x, dict):
+            return dict([(self.unpack_eoms(k, dummies), self.unpack_eoms(v,
+                dummies)) for k, v in x.items()])
+        if isinstance(x, (list, tuple)):
+            return type(x)([self.unpack_eoms(e, dummies) for e in x])
+        if isinstance(x, Basic):
+            for d in x.atoms(Dummy):
+                if d not in dummies:
+                    dummies[d] = Dummy(d.name)
+            return self.from_symbols(x).subs(dummies)
+        return x
+
+    def eom_cache_path(self, cache_dir, extra=None):
+        """Returns the file in cache_dir used by save_eoms() and
+        load_eoms() for this model.
+        """
+        return os.path.join(cache_dir, self.model_hash(extra) + '.pickle')
+
+    def save_eoms(self, cache_dir, atomic=True, extra=None):
+        """Saves the derived equations of motion (the attributes named in
+        eom_attributes which have been set) to cache_dir, under the
+        model_hash() of the system and extra.  Returns the path of the file.
+
+        With atomic=True the file is written under a temporary name and
+        renamed, so that concurrent runs never load a partial file.  As the
+        files are unpickled by load_eoms(), cache_dir must be private to the
+        user (see private_directory()).
+        """
+        cache_dir = private_directory(cache_dir)
+        path = self.eom_cache_path(cache_dir, extra)
+        eoms = {}
+        for a in self.eom_attributes:
+            if hasattr(self, a):
+                eoms[a] = self.pack_eoms(getattr(self, a))
+        if atomic:
+            fd, tmp = tempfile.mkstemp(dir=cache_dir)
+            f = os.fdopen(fd, 'wb')
+        else:
+            f = open(path, 'wb')
+        try:
+            pickle.dump(eoms, f, 2)
+        finally:
+            f.close()
+        if atomic:
+            os.rename(tmp, path)
+        return path
+
+    def load_eoms(self, cache_dir, extra=None):
+        """Sets the equations of motion saved by save_eoms() for a model with
+        the same model_hash() and extra.  Returns False if there are none.
+
+        Unpickling can run arbitrary code, so ValueError is raised unless
+        cache_dir belongs to the user and is not writable by others.
+        """
+        cache_dir = private_directory(cache_dir)
+        path = self.eom_cache_path(cache_dir, extra)
+        if not os.path.exists(path):
+            return False
+        f = open(path, 'rb')
+        try:
+            eoms = pickle.load(f)
+        finally:
+            f.close()
+        dummies = {}
+        for a, value in eoms.items():
+            setattr(self, a, self.unpack_eoms(value, dummies))
+        return True
+
+    def solve_kanes_equations(self, dummy_vars=None, method='adjugate'):
         """Solves Kane's equations for the time derivatives of the generalized
         speeds.
 
-        Forms the adjugate matrix, factors out common terms along the rows,
-        performs the matrix multiplication, and then multiplies by the common
-        terms and divides by the determinant.
+        With method='adjugate', forms the adjugate matrix, factors out common
+        terms along the rows, performs the matrix multiplication, and then
+        multiplies by the common terms and divides by the determinant.
 
-        If optional dummy_mass_matrix argument is eqaul to True, returns the
-        result with dummy symbols, and a dictionary with the dummy symbols as
-        keys and the expression they represent as the corresponding values.
+        With method='lu', the dummy mass matrix is factored by sparse
+        Gaussian elimination (see sparse_solve()), each intermediate result
+        being named by a dummy symbol z0001, z0002, ...  The cost grows
+        roughly with the cube of the number of speeds instead of factorially.
+        Unless dummy_vars is given, the intermediates are substituted back
+        without expanding (see substitute_intermediates()).
+
+        If optional dummy_vars argument is eqaul to True, returns the result
+        with dummy symbols, and a dictionary with the dummy symbols as keys
+        and the expression they represent as the corresponding values.
+        Sorting its keys gives an order in which they can be evaluated.
         """
+        if method not in ('adjugate', 'lu'):
+            raise ValueError("method must be 'adjugate' or 'lu'")
         m, n = self.mass_matrix.shape
         assert m == n
         mm, mm_dict = dummy_matrix(self.mass_matrix, 'M')
@@ -1952,6 +2632,21 @@ class NewtonianReferenceFrame(ReferenceFrame):
         mm_dict.update(ke_dict)
         assert ke_rhs.shape == (n, 1)
 
+        if method == 'lu':
+            x, z_dict = sparse_solve(mm, ke_rhs, 'z')
+            if dummy_vars == None:
+                x = [rhs.subs(mm_dict) for rhs in
+                        substitute_intermediates(x, z_dict)]
+            dyndiffs = []
+            for i, udot in enumerate(self.udot_independent):
+                dyndiffs.append(Eq(udot, x[i]))
+            if dummy_vars:
+                mm_dict.update(z_dict)
+                self.dummy_dict = mm_dict
+                return dyndiffs, mm_dict
+            else:
+                return dyndiffs
+
         # Form the adjugate and the determinant
         mm_adj = mm.adjugate().expand()
         for i in range(m):
@@ -1996,6 +2691,7 @@ class NewtonianReferenceFrame(ReferenceFrame):
             dyndiffs.append(Eq(udot, rhs))
 
         if dummy_vars:
+            self.dummy_dict = mm_dict
             return dyndiffs, mm_dict
         else:
             return dyndiffs
@@ -2018,6 +2714,108 @@ class NewtonianReferenceFrame(ReferenceFrame):
             for child in PorF.children:
                 self.recursive_eoms(child)
 
+    def generate_mass_matrix_functions(self, name, kd_eqs, func_args,
+            params=None, docstring=None, time=None, solver='lu',
+            vectorized=None, out=None):
+        """Generate Python functions which evaluate the mass matrix and the
+        forcing vector of Kane's equations numerically, instead of solving
+        for the udots symbolically.
+
+        form_kanes_equations() must have been called.  Three functions are
+        returned in one string, all with the signature of the functions made
+        by generate_function():
+
+            name_mass_matrix:   the entries of the n x n mass matrix M(q),
+                                row by row, as one list
+            name_forcing:       the right hand sides of kd_eqs followed by the
+                                forcing vector f(q, u), with M*udot = f
+            name:               the right hand sides of kd_eqs followed by the
+                                udots, solving M*udot = f numerically
+
+        With solver='lu' the udots are found with numpy.linalg.solve.  With
+        solver='cholesky', scipy.linalg.cho_factor and cho_solve are used;
+        the mass matrix formed by PyDy is the negative of the (symmetric
+        positive definite) physical one, so it is negated first.
+
+        With vectorized=True all three functions evaluate many states at once,
+        as described in generate_function(), and return arrays; the mass
+        matrices are then returned with shape (n_states, n, n).  Only the 'lu'
+        solver supports this.
+
+        With out=True name_forcing and name return arrays and take an optional
+        _out argument to write into, as described in generate_function(); the
+        udots are then solved for in place.
+        """
+        if solver not in ('lu', 'cholesky'):
+            raise ValueError("solver must be 'lu' or 'cholesky'")
+        if vectorized and solver != 'lu':
+            raise ValueError("vectorized functions require solver='lu'")
+        n = self.mass_matrix.shape[0]
+        nkd = len(kd_eqs)
+        mm_eqs = [Eq(Symbol('_M%d_%d' % (i, j)), self.mass_matrix[i, j]) for i
+                in range(n) for j in range(n)]
+        f_eqs = [Eq(Symbol('_f%d' % i), ke.rhs) for i, ke in
+                enumerate(self.kanes_equations)]
+        fs = "from numpy import array, concatenate\n"
+        if solver == 'lu':
+            fs += "from numpy.linalg import solve\n\n"
+        else:
+            fs += "from scipy.linalg import cho_factor, cho_solve\n\n"
+        if vectorized:
+            mm_name = "_" + name + "_mass_matrix_entries"
+            fs += generate_function(mm_name, mm_eqs, func_args, params,
+                    time=time, vectorized=True)
+        else:
+            mm_name = name + "_mass_matrix"
+            fs += generate_function(mm_name, mm_eqs, func_args, params,
+                    time=time)
+        fs += generate_function(name + "_forcing", kd_eqs + f_eqs, func_args,
+                params, time=time, vectorized=vectorized, out=out)
+
+        args = "_x"
+        if time:
+            args += ", t"
+        if params:
+            args += ", _params"
+        if vectorized:
+            fs += "def " + name + "_mass_matrix(" + args + "):\n"
+            fs += "    _M = " + mm_name + "(" + args + ")\n"
+            fs += "    return _M.reshape(_M.shape[:-1] + (%d, %d))\n\n" % (n,
+                    n)
+        if out:
+            fs += "def " + name + "(" + args + ", _out=None):\n"
+        else:
+            fs += "def " + name + "(" + args + "):\n"
+        if docstring:
+            fs += '    """' + docstring + '\n    """\n'
+        if out:
+            fs += "    _rhs = " + name + "_forcing(" + args + ", _out)\n"
+        else:
+            fs += "    _rhs = " + name + "_forcing(" + args + ")\n"
+        if vectorized:
+            fs += "    _M = " + name + "_mass_matrix(" + args + ")\n"
+            fs += "    _ud = solve(_M, _rhs[..., %d:, None])[..., 0]\n" % nkd
+            if out:
+                fs += "    _rhs[..., %d:] = _ud\n" % nkd
+                fs += "    return _rhs\n\n"
+            else:
+                fs += "    return concatenate((_rhs[..., :%d], _ud), -1)\n\n"\
+                        % nkd
+            return fs
+        fs += "    _M = array(" + mm_name + "(" + args + \
+                ")).reshape((%d, %d))\n" % (n, n)
+        if solver == 'lu':
+            fs += "    _ud = solve(_M, _rhs[%d:])\n" % nkd
+        else:
+            fs += "    _ud = cho_solve(cho_factor(-_M), -array(_rhs[%d:]))\n"\
+                    % nkd
+        if out:
+            fs += "    _rhs[%d:] = _ud\n" % nkd
+            fs += "    return _rhs\n\n"
+        else:
+            fs += "    return _rhs[:%d] + list(_ud)\n\n" % nkd
+        return fs
+
     def output_eoms(self, filename, *args):
         """Output the equations of motion to a file as a function which can be
         integrated by scipy.odeint
@@ -2191,14 +2989,65 @@ class NewtonianReferenceFrame(ReferenceFrame):
         return eqns_cond
 
 
+# The system, its bodies and subs_dict while NewtonianReferenceFrame.
+# parallel_forces() runs; the forked workers read it from here.
+_kane_system = None
+
+def _kane_body_worker(index):
+    """Computes the partial velocities, generalized active forces and
+    generalized inertia forces of one body, and its contribution to the mass
+    matrix, in a worker process.
+    """
+    nrf, bodies, subs_dict = _kane_system
+    PorF = bodies[index]
+    p = len(nrf.u_independent)
+    nrf.mass_matrix = zeros((p, p))
+    nrf.body_partials(PorF)
+    nrf.body_fr(PorF)
+    nrf.body_frstar(PorF, subs_dict=subs_dict)
+    attrs = ['partialv', 'gen_active_force', 'gen_inertia_force']
+    if nrf.body_has_inertia(PorF):
+        attrs += ['udot_coefficients', 'gyroscopic_terms']
+    mm = [[nrf.to_symbols(nrf.mass_matrix[i, j]) for j in range(p)] for i in
+            range(p)]
+    return nrf.pack_body(PorF, attrs), mm
+
+def _kane_inertia_worker(index):
+    """Computes the partial velocities of one body and the coefficients of
+    the udots and gyroscopic terms in its inertia force, in a worker
+    process.
+    """
+    nrf, bodies, subs_dict = _kane_system
+    PorF = bodies[index]
+    nrf.body_partials(PorF)
+    if nrf.body_has_inertia(PorF):
+        nrf.inertia_terms(PorF, subs_dict=subs_dict)
+        return nrf.pack_body(PorF, ['partialv', 'udot_coefficients',
+            'gyroscopic_terms'])
+    else:
+        return nrf.pack_body(PorF, ['partialv'])
+
+def _kane_row_worker(task):
+    """Returns row i of the generalized active force, generalized inertia
+    force and mass matrix contribution of body index, where task is the
+    pair (index, i), in a worker process.
+    """
+    index, i = task
+    nrf, bodies, subs_dict = _kane_system
+    PorF = bodies[index]
+    gaf = nrf.to_symbols(nrf.fr_row(PorF, i))
+    if nrf.body_has_inertia(PorF):
+        mm_row, gif = nrf.frstar_row(PorF, i)
+        mm_row = [nrf.to_symbols(c) for c in mm_row]
+        gif = (nrf.to_symbols(gif[0]), nrf.to_symbols(gif[1]))
+    else:
+        mm_row, gif = None, (S(0), S(0))
+    return gaf, gif, mm_row
+
 class PyDyStrPrinter(StrPrinter):
     #printmethod = '_sympystr_'
     def _print_UnitVector(self, e):
-        s = str(e.v['sym'])
-        name = s[:-1]
-        index = s[-1]
-        r = "%s%s>" % (name, index)
-        return r
+        return "%s%d>" % (e.frame.name.lower(), e.i)
 
     def _print_Vector(self, e):
         s = ''
@@ -2350,9 +3199,8 @@ class PyDyPrettyPrinter(PrettyPrinter):
                 three = "\xe2\x82\x83"
                 bold = "\033[1m"
                 reset = "\033[0;0m"
-                s = str(e.v['sym'])
-                name = s[:-1]
-                index = s[-1]
+                name = e.frame.name.lower()
+                index = str(e.i)
                 r = "%s%s" % (bold, name)
                 if index == "1":
                     r += one
@@ -2484,7 +3332,9 @@ class PyDyPrettyPrinter(PrettyPrinter):
         return Fake()
 
 from functions import (sort_UnitVector, gcs, cross, dt, dot, dummy_matrix,
-        animate, generate_function)
+        animate, generate_function, tree_path, linear_coefficients,
+        monomial_coefficients, sparse_solve, substitute_intermediates,
+        private_directory)
 
 if __name__ == "__main__":
         import doctest
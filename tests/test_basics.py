@@ -1,5 +1,9 @@
 from pydy import *
+from pydy.functions import sort_UnitVector, linear_coefficients, \
+        sparse_solve, compile_function, compile_linear_transform, \
+        linear_transform, common_subexpressions
 
+from unittest import SkipTest
 from sympy import symbols, S, Symbol, Function, sin, cos, tan, Matrix, eye, \
     Rational, pprint, trigsimp, expand
 
@@ -28,6 +32,15 @@ def test_UnitVector():
     a1 = UnitVector(A, 1)
     a2 = UnitVector(A, 2)
     a3 = UnitVector(A, 3)
+    assert a1 == A[1] and hash(a1) == hash(A[1])
+    assert {A[2]: 1}[a2] == 1
+    assert a1.key != N[1].key
+    assert a3.num == Matrix([0, 0, 1])
+    assert not hasattr(a1, '__dict__')
+    uv_list = [B[1], A[3], N[2], A[1], N[1]]
+    uv_list.sort(sort_UnitVector)
+    assert [(uv.frame, uv.i) for uv in uv_list] == [(N, 1), (N, 2), (A, 1),
+            (A, 3), (B, 1)]
 
 def test_dot_cross():
     assert dot(A[1], A[1]) == 1
@@ -515,6 +528,8 @@ def test_get_frames_list4():
     assert N.get_frames_list(B) == [N, A, B]
     assert C.get_frames_list(N) == [C, B, A, N]
     assert N.get_frames_list(C) == [N, A, B, C]
+    assert F.get_frames_path(C) == (F, E, D, A, B, C)
+    assert F.get_frames_path(C) is F.get_frames_path(C)
 
 def test_get_rot_matrices1():
     B_A = Matrix([
@@ -587,6 +602,90 @@ def test_get_rot_matrices2():
     assert C.get_rot_matrices(F) == [F_E, E_D, D_A, A_B, B_C]
     assert F.get_rot_matrices(C) == [C_B, B_A, A_D, D_E, E_F]
 
+def test_get_dcm():
+    N = NewtonianReferenceFrame('N')
+    q, qd = N.declare_coords('q', 3)
+    q1, q2, q3 = q
+    A = N.rotate('A', 3, q1)
+    B = A.rotate('B', 1, q2)
+    C = B.rotate('C', 2, q3)
+
+    C_N = C.get_dcm(N)
+    m = C.get_rot_matrices(N)
+    assert C_N == m[0]*m[1]*m[2]
+    assert N.get_dcm(C) == C_N.T
+    info = N.dcm_cache_info()
+    assert info['misses'] == 1
+    assert info['hits'] == 1
+    assert C.get_dcm(N) is C_N
+    assert N.dcm_cache_info()['hits'] == 2
+
+    # Growing the tree invalidates the cache
+    D = C.rotate('D', 3, q1)
+    assert N.dcm_cache_info()['size'] == 0
+
+def test_compute_uv_products():
+    N = NewtonianReferenceFrame('N')
+    q, qd = N.declare_coords('q', 2)
+    q1, q2 = q
+    A = N.rotate('A', 3, q1)
+    B = A.rotate('B', 1, q2)
+    # One lookup fills the whole table for the pair of frames
+    assert dot(B[2], N[3]) == sin(q2)
+    assert len(N.uv_cross_products) == 9
+    assert len(N.uv_dot_products) == 18
+    assert dot(N[1], B[1]) == cos(q1)
+    assert cross(B[1], A[1]) == Vector(0)
+    assert cross(A[3], B[1]) == A[2]
+    assert cross(B[1], A[3]) == -A[2]
+    assert cross(B[3], N[3]) == Vector(-sin(q2)*B[1])
+
+def test_express_cache():
+    N = NewtonianReferenceFrame('N')
+    q, qd = N.declare_coords('q', 1)
+    A = N.rotate('A', 3, q[0])
+    N.clear_express_cache()
+    v = Vector(q[0]*A[1] + A[2])
+    assert v.express(N) == v.express(N)
+    info = N.express_cache_info()
+    assert info['misses'] == 2
+    assert info['hits'] == 2
+    assert info['size'] == 2
+    N.set_express_cache_size(1)
+    assert N.express_cache_info()['size'] == 1
+    N.clear_express_cache()
+    assert N.express_cache_info()['size'] == 0
+
+def test_LRUCache():
+    from pydy.common import LRUCache
+    c = LRUCache(2)
+    c['a'] = 1
+    c['b'] = 2
+    assert c.get('a') == 1
+    c['c'] = 3
+    assert 'b' not in c
+    assert c.get('a') == 1 and c.get('c') == 3
+    assert c.get('b') is None
+    assert c.info()['hits'] == 3 and c.info()['misses'] == 1
+
+def test_simplification_policy():
+    N = NewtonianReferenceFrame('N')
+    q, qd = N.declare_coords('q', 1)
+    q1 = q[0]
+    e = q1*cos(q1)**2 + q1*sin(q1)**2
+    assert N.simplification == 'csqrd'
+    assert N.simplify(e) == q1
+    assert N.simplify_cache[e] == q1
+    N.set_simplification('none')
+    assert N.simplify(e) == e
+    N.set_simplification('trigsimp')
+    assert N.simplify(e) == q1
+    try:
+        N.set_simplification('fast')
+        assert False
+    except ValueError:
+        pass
+
 def test_cross2():
     for i in (1, 2, 3):
         for j in (1, 2, 3):
@@ -638,6 +737,436 @@ def test_Vector_class():
     v5 = Vector(q1*sin(q2)*B[1] + t*u1*q1*sin(q2)*B[2])
     assert v3 == v5
     assert v5.dict == {B[1]: q1*sin(q2), B[2]: t*u1*q1*sin(q2)}
+    # Measure numbers grouped by frame
+    assert v4.frame_blocks() == {A: [q1*u1, q2*t*sin(t), 0],
+            B: [q1*sin(q2), t*u1*q1*sin(q2), 0]}
+    # A[1] is fixed in B as well, so it joins the B block when expressing in B
+    assert Vector(q1*A[1] + q2*B[2]).frame_blocks(B) == {B: [q1, q2, 0]}
+
+def test_Vector_trusted():
+    v = Vector.trusted({A[1]: q1, A[2]: S(0), A[3]: q2 - q2})
+    assert v.dict == {A[1]: q1}
+    assert v == Vector(q1*A[1])
+    assert (-v).dict == {A[1]: -q1}
+    Vector.debug = True
+    try:
+        try:
+            Vector.trusted({A[1]: 1})
+            assert False
+        except TypeError:
+            pass
+        assert Vector.trusted({A[1]: q1}) == Vector(q1*A[1])
+    finally:
+        Vector.debug = False
+
+def test_partials():
+    u1, u2, a, b = symbols('u1 u2 a b')
+    v = Vector((a*u1 + b*u2 + a*b)*A[1] + u2*A[2] + u1*u2*A[3])
+    assert v.partials([u1, u2]) == [Vector(a*A[1]), Vector(b*A[1] + A[2])]
+    assert linear_coefficients(a*u1 + 2*u1*u2 - u1**2*b + a, [u1, u1*u2,
+        u1**2, u2]) == [a, 2, -b, 0]
+
+def _two_dof_system(mass_factor=1):
+    """A body A rotating about N[3] by q1 along which a particle P of mass
+    mass_factor*m slides by q2, under gravity.  Returns N, A, P, the
+    coordinates, their derivatives, the speeds and the parameters m, g, I.
+    """
+    N = NewtonianReferenceFrame('N')
+    (q1, q2), (q1d, q2d) = N.declare_coords('q', 2)
+    (u1, u2), (u1d, u2d) = N.declare_speeds('u', 2)
+    m, g, I = N.declare_parameters('m g I')
+    A = N.rotate('A', 3, q1, I=(I, I, I, 0, 0, 0))
+    P = N.O.locate('P', q2*A[1], mass=mass_factor*m)
+    A.abs_ang_vel = Vector(u1*A[3])
+    P.abs_vel = Vector(u2*A[1] + q2*u1*A[2])
+    N.gravity(g*N[1])
+    return N, A, P, (q1, q2), (q1d, q2d), (u1, u2), (m, g, I)
+
+def test_frstar_gyroscopic_terms():
+    N, A, P, (q1, q2), (q1d, q2d), (u1, u2), params = _two_dof_system()
+    m, g, I = params
+    N.form_kanes_equations()
+    # Only the products present in the inertia force are kept
+    assert P.gyroscopic_terms == {u1**2: Vector(m*q2*A[1]),
+            u1*q2d: Vector(-m*A[2]), u1*u2: Vector(-m*A[2])}
+    assert N.ke_rhs_if[1] == -m*q2*u1**2
+
+def test_form_kanes_equations_processes():
+    N, A, P, (q1, q2), (q1d, q2d), (u1, u2), params = _two_dof_system()
+    m, g, I = params
+    serial = N.form_kanes_equations()
+    mm = N.mass_matrix
+    parallel = N.form_kanes_equations(processes=2)
+    assert N.mass_matrix == mm
+    for e1, e2 in zip(serial, parallel):
+        assert ((e1.lhs - e1.rhs) - (e2.lhs - e2.rhs)).expand() == 0
+    assert P.partialv == [Vector(q2*A[2]), Vector(A[1])]
+    assert P.gyroscopic_terms[u1*u2] == Vector(-m*A[2])
+    rows = N.form_kanes_equations(processes=2, fan_out='row')
+    assert N.mass_matrix == mm
+    for e1, e2 in zip(serial, rows):
+        assert ((e1.lhs - e1.rhs) - (e2.lhs - e2.rhs)).expand() == 0
+
+def test_sparse_solve():
+    a, b, c, d, e, f = symbols('a b c d e f')
+    A = Matrix([[a, 0, b], [0, c, 0], [b, 0, d]])
+    B = Matrix([e, f, 0])
+    stats = {}
+    X, z = sparse_solve(A, B, stats=stats)
+    keys = z.keys()
+    keys.sort()
+    for k in reversed(keys):
+        X = X.subs(k, z[k])
+    assert [x.simplify() for x in (A*X - B)] == [0, 0, 0]
+    # The middle row and column are decoupled, so no fill-in is needed
+    assert stats['fill_in'] == 0
+    assert stats['pivots'][0] == (1, 1)
+
+def test_solve_kanes_equations_lu():
+    N, A, P, (q1, q2), (q1d, q2d), (u1, u2), params = _two_dof_system()
+    m, g, I = params
+    N.form_kanes_equations()
+    adj = N.solve_kanes_equations()
+    lu = N.solve_kanes_equations(method='lu')
+    for e1, e2 in zip(adj, lu):
+        assert e1.lhs == e2.lhs
+        assert (e1.rhs - e2.rhs).expand().simplify() == 0
+
+def test_solve_kanes_equations_lu_coupled():
+    N = NewtonianReferenceFrame('N')
+    q, qd = N.declare_coords('q', 3)
+    u, ud = N.declare_speeds('u', 3)
+    m, g, l = params = N.declare_parameters('m g l')
+    P = N.O
+    v = Vector(0)
+    for i in range(3):
+        F = N.rotate('F%d' % i, 3, q[i])
+        F.abs_ang_vel = Vector(u[i]*N[3])
+        P = P.locate('P%d' % i, l*F[1], mass=m)
+        v = v + Vector(l*u[i]*F[2])
+        P.abs_vel = v
+    N.gravity(g*N[1])
+    N.form_kanes_equations()
+    kd = [Eq(qd[i], u[i]) for i in range(3)]
+    ns = {}
+    adj = kd + N.solve_kanes_equations()
+    lu = kd + N.solve_kanes_equations(method='lu')
+    exec "from math import sin, cos\n" + generate_function('adj', adj, q + u,
+            params, cse=False) in ns
+    exec "from math import sin, cos\n" + generate_function('lu', lu, q + u,
+            params, cse=False) in ns
+    x, p = [0.3, -0.7, 1.1, 0.5, -0.2, 0.9], [1.5, 9.81, 0.8]
+    for a, b in zip(ns['adj'](x, p), ns['lu'](x, p)):
+        assert abs(a - b) < 1e-10
+
+def test_generate_mass_matrix_functions():
+    N, A, P, (q1, q2), (q1d, q2d), (u1, u2), params = _two_dof_system()
+    m, g, I = params
+    N.form_kanes_equations()
+    kd = [Eq(q1d, u1), Eq(q2d, u2)]
+    dd = N.solve_kanes_equations()
+    ns = {}
+    exec "from math import sin, cos\n" + generate_function('eoms', kd + dd,
+            [q1, q2, u1, u2], params) in ns
+    exec "from math import sin, cos\n" + N.generate_mass_matrix_functions(
+            'mm_eoms', kd, [q1, q2, u1, u2], params) in ns
+    x, p = [0.3, 1.5, -0.2, 0.4], [2.0, 9.81, 0.5]
+    for a, b in zip(ns['eoms'](x, p), ns['mm_eoms'](x, p)):
+        assert abs(a - b) < 1e-12
+    assert len(ns['mm_eoms_mass_matrix'](x, p)) == 4
+    exec N.generate_mass_matrix_functions('v_eoms', kd, [q1, q2, u1, u2],
+            params, vectorized=True) in ns
+    X = [x, [-0.1, 0.9, 0.3, 0.0], [1.2, 2.0, 0.0, -0.5]]
+    V = ns['v_eoms'](X, p)
+    assert V.shape == (3, 4)
+    assert ns['v_eoms_mass_matrix'](X, p).shape == (3, 2, 2)
+    for xi, vi in zip(X, V):
+        for a, b in zip(ns['eoms'](xi, p), vi):
+            assert abs(a - b) < 1e-12
+    exec N.generate_mass_matrix_functions('o_eoms', kd, [q1, q2, u1, u2],
+            params, out=True) in ns
+    from numpy import zeros
+    buf = zeros(4)
+    assert ns['o_eoms'](x, p, buf) is buf
+    for a, b in zip(ns['eoms'](x, p), buf):
+        assert abs(a - b) < 1e-12
+
+def test_generate_mass_matrix_functions_cholesky():
+    try:
+        import scipy.linalg
+    except ImportError:
+        raise SkipTest("scipy is not installed")
+    N, A, P, (q1, q2), (q1d, q2d), (u1, u2), params = _two_dof_system()
+    m, g, I = params
+    N.form_kanes_equations()
+    kd = [Eq(q1d, u1), Eq(q2d, u2)]
+    ns = {}
+    exec "from math import sin, cos\n" + N.generate_mass_matrix_functions(
+            'lu', kd, [q1, q2, u1, u2], params) in ns
+    exec "from math import sin, cos\n" + N.generate_mass_matrix_functions(
+            'chol', kd, [q1, q2, u1, u2], params, solver='cholesky') in ns
+    x, p = [0.3, 1.5, -0.2, 0.4], [2.0, 9.81, 0.5]
+    for a, b in zip(ns['lu'](x, p), ns['chol'](x, p)):
+        assert abs(a - b) < 1e-12
+
+def test_generate_function_vectorized():
+    from numpy import array
+    x, y = symbols('x y')
+    eqs = [Eq(Symbol('a'), x*y), Eq(Symbol('b'), S(2)), Eq(Symbol('c'), x - y)]
+    ns = {}
+    exec generate_function('f', eqs, [x], [y], vectorized=True) in ns
+    out = ns['f']([[1.0], [2.0], [3.0], [4.0]], [array([0.5, 1.0, 2.0, 3.0])])
+    assert out.shape == (4, 3)
+    assert list(out[:, 1]) == [2.0]*4
+    assert list(out[:, 2]) == [0.5, 1.0, 1.0, 1.0]
+    exec generate_function('f', eqs, [x], [y], vectorized=True,
+            triples=True) in ns
+    assert ns['f']([1.0], [2.0]).shape == (1, 3)
+    assert ns['f']([[1.0], [2.0]], [2.0]).shape == (2, 1, 3)
+    from sympy import exp, sqrt, atan2, Abs
+    eqs = [Eq(Symbol('a'), exp(x)*y), Eq(Symbol('b'), sqrt(x) + Abs(y)),
+           Eq(Symbol('c'), atan2(y, x))]
+    exec "from __future__ import division\n" + generate_function('f', eqs,
+            [x, y], vectorized=True) in ns
+    out = ns['f']([[1.0, -2.0], [4.0, 0.0]])
+    assert abs(out[0, 0] + 2*2.718281828459045) < 1e-12
+    assert list(out[:, 1]) == [3.0, 2.0]
+    assert out[1, 2] == 0.0
+    f = Function('f')
+    try:
+        generate_function('f', [Eq(Symbol('a'), f(x))], [x], vectorized=True)
+        assert False
+    except ValueError:
+        pass
+
+def test_generate_function_out():
+    from numpy import zeros, ndarray
+    x, y = symbols('x y')
+    eqs = [Eq(Symbol('a'), x*y), Eq(Symbol('b'), x + y), Eq(Symbol('c'), S(3))]
+    ns = {}
+    fs = generate_function('f', eqs, [x, y], out=True)
+    assert fs.startswith('def f(')
+    # Nothing is imported when _out is passed
+    assert '\n    from numpy' not in fs
+    exec fs in ns
+    assert 'empty' not in ns
+    assert isinstance(ns['f']([2.0, 3.0]), ndarray)
+    buf = zeros(3)
+    assert ns['f']([2.0, 3.0], buf) is buf
+    assert list(buf) == [6.0, 5.0, 3.0]
+    exec generate_function('f', eqs, [x, y], out=True, triples=True) in ns
+    assert ns['f']([2.0, 3.0], buf).shape == (1, 3)
+    exec generate_function('f', eqs, [x], [y], out=True,
+            vectorized=True) in ns
+    buf = zeros((2, 3))
+    assert ns['f']([[2.0], [1.0]], [3.0], buf) is buf
+    assert list(buf[1]) == [3.0, 4.0, 3.0]
+
+def test_compile_function():
+    import tempfile, os
+    N = NewtonianReferenceFrame('N')
+    (q1,), (q1d,) = N.declare_coords('q', 1)
+    (u1,), (u1d,) = N.declare_speeds('u', 1)
+    g, l = params = N.declare_parameters('g l')
+    eqs = [Eq(q1d, u1), Eq(u1d, -g/l*sin(q1) - q1d*cos(q1)**2/2)]
+    ns = {}
+    exec "from math import sin, cos\n" + generate_function('eoms', eqs,
+            [q1, u1], params, time=True) in ns
+    d = tempfile.mkdtemp()
+    f = compile_function('eoms', eqs, [q1, u1], params, time=True,
+            cache_dir=d)
+    x, p = [0.3, -1.2], [9.81, 0.5]
+    for a, b in zip(ns['eoms'](x, 0.0, p), f(x, 0.0, p)):
+        assert abs(a - b) < 1e-12
+    files = os.listdir(d)
+    f = compile_function('eoms', eqs, [q1, u1], params, time=True,
+            cache_dir=d)
+    assert os.listdir(d) == files
+    assert f(x, 0.0, p).shape == (2,)
+    fp = compile_function('eoms', eqs, [q1, u1], params, time=True,
+            backend='python')
+    for a, b in zip(ns['eoms'](x, 0.0, p), fp(x, 0.0, p)):
+        assert abs(a - b) < 1e-12
+    assert compile_function('eoms', eqs, [q1, u1], params, time=True,
+            backend='python') is fp
+    # Common subexpressions which would take the square root of b**2
+    a, b, c = symbols('a b c')
+    eqs = [Eq(Symbol('y0'), a/b), Eq(Symbol('y1'), b**2*c), Eq(Symbol('y2'),
+        b**2*a + a/b), Eq(Symbol('y3'), a*b**2)]
+    fc = compile_function('f', eqs, [a, b, c], cache_dir=d)
+    fp = compile_function('f', eqs, [a, b, c], backend='python')
+    for x in ([1.0, -2.0, 3.0], [-0.5, -1.5, -2.0], [2.0, 0.5, -1.0]):
+        assert abs(fc(x)[0] - x[0]/x[1]) < 1e-12
+        for a, b in zip(fc(x), fp(x)):
+            assert abs(a - b) < 1e-12
+    os.chmod(d, 0777)
+    try:
+        compile_function('eoms', eqs, [q1, u1], params, cache_dir=d)
+        assert False
+    except ValueError:
+        pass
+
+def test_compile_function_cython():
+    import tempfile
+    try:
+        import Cython
+    except ImportError:
+        raise SkipTest("Cython is not installed")
+    N = NewtonianReferenceFrame('N')
+    (q1,), (q1d,) = N.declare_coords('q', 1)
+    (u1,), (u1d,) = N.declare_speeds('u', 1)
+    g, l = params = N.declare_parameters('g l')
+    from sympy import atan2, sinh, exp
+    eqs = [Eq(q1d, u1), Eq(u1d, -g/l*sin(q1) + atan2(u1, l)*sinh(q1) +
+        exp(-u1**2))]
+    fc = compile_function('eoms', eqs, [q1, u1], params, cache_dir=
+            tempfile.mkdtemp())
+    f = compile_function('eoms', eqs, [q1, u1], params, backend='cython',
+            cache_dir=tempfile.mkdtemp())
+    x, p = [0.3, -1.2], [9.81, 0.5]
+    for a, b in zip(fc(x, p), f(x, p)):
+        assert abs(a - b) < 1e-12
+
+def test_compile_function_python_math():
+    from math import atan2 as m_atan2, asin as m_asin, exp as m_exp, \
+            cosh as m_cosh, log as m_log
+    from sympy import atan2, asin, exp, cosh, log, Abs
+    x, y = symbols('x y')
+    eqs = [Eq(Symbol('a'), atan2(x, y) + asin(x/2)), Eq(Symbol('b'), exp(y)*
+        cosh(x) - log(Abs(y)))]
+    f = compile_function('f', eqs, [x, y], backend='python')
+    a, b = f([0.5, -1.5])
+    assert abs(a - m_atan2(0.5, -1.5) - m_asin(0.25)) < 1e-12
+    assert abs(b - m_exp(-1.5)*m_cosh(0.5) + m_log(1.5)) < 1e-12
+
+def test_compile_linear_transform():
+    a, b = symbols('a b')
+    f = compile_linear_transform(Matrix([[a, 0], [1, b]]), [a, b], 'f')
+    assert f([2.0, 3.0], [5.0, 7.0]) == [10.0, 23.0]
+
+def test_transform_matrix_sparse():
+    a, b, c, d = symbols('a b c d')
+    x = list(symbols('x0:5'))
+    B = Matrix([[a, 0, b, 1, 0], [0, c, 0, a*d, 2], [d, 0, 0, 0, b + c]])
+    Bd_inv, Bi = transform_matrix(B, x, [x[0], x[1], x[4]])
+    stats = {}
+    T = transform_matrix(B, x, [x[0], x[1], x[4]], method='sparse',
+            stats=stats)
+    values = {a: 2, b: 3, c: 5, d: 7}
+    assert (Bd_inv*Bi).subs(values) == T.subs(values)
+    assert stats['ops'] < stats['dense_ops']
+    # Both count the same operations, so they agree for a full matrix
+    transform_matrix(Matrix([[a, b, 1], [c, d, a]]), x[:3], x[:2],
+            method='sparse', stats=stats)
+    assert stats['ops'] == stats['dense_ops'] == 9
+    T, z = transform_matrix(B, x, [x[0], x[1], x[4]], subs_dict=True,
+            method='sparse')
+    assert T.shape == (3, 2)
+
+def test_linear_transform_sparse():
+    a, b, c = symbols('a b c')
+    B = Matrix([[a*b + c, 0, 0], [0, 0, 0], [2*(a*b + c), 0, b]])
+    f = compile_linear_transform(B, [a, b, c], 'f', det=a - c, sparse=True)
+    fs = linear_transform(B, [a, b, c], 'f', det=a - c, sparse=True)
+    assert fs.count('_idet =') == 1
+    y = f([[1.0, 5.0, 2.0], [2.0, 5.0, -1.0]], [2.0, 3.0, 1.0])
+    assert y.shape == (2, 3)
+    assert list(y[0]) == [7.0, 0.0, 20.0]
+    assert list(y[1]) == [14.0, 0.0, 25.0]
+    assert list(f([1.0, 5.0, 2.0], [2.0, 3.0, 1.0])) == [7.0, 0.0, 20.0]
+    # The determinant shares the common subexpression a*b + c
+    fs = linear_transform(B, [a, b, c], 'f', det=a*b + c, sparse=True,
+            y=symbols('v0 v1 v2'))
+    assert fs.count('a*b') == 1
+    assert 'v2 = ' in fs
+    ns = {}
+    exec fs in ns
+    y = ns['f']([1.0, 5.0, 2.0], [2.0, 3.0, 1.0])
+    assert list(y[:2]) == [1.0, 0.0]
+    assert abs(y[2] - 20/7.) < 1e-12
+    # cse() would write det as a power of det**2, losing its sign
+    B = Matrix([[b*(a - c)**2, c*(a - c)**2], [b/(a - c), 0]])
+    f = compile_linear_transform(B, [a, b, c], 'f', det=1/(a - c),
+            sparse=True)
+    f_dense = compile_linear_transform(B, [a, b, c], 'f', det=1/(a - c))
+    for p in ([1.0, 2.0, 3.0], [-1.0, 2.0, 1.0], [3.0, -2.0, 1.0]):
+        for u, v in zip(f([1.5, -0.5], p), f_dense([1.5, -0.5], p)):
+            assert abs(u - v) < 1e-12
+
+def test_save_eoms():
+    import tempfile, os
+    d = tempfile.mkdtemp()
+    N = _two_dof_system()[0]
+    assert not N.load_eoms(d)
+    N.form_kanes_equations()
+    dyndiffs, dummies = N.solve_kanes_equations(dummy_vars=True)
+    N.save_eoms(d)
+    N2 = _two_dof_system()[0]
+    assert N2.model_hash() == N.model_hash()
+    assert N2.load_eoms(d)
+    assert str(N2.kanes_equations) == str(N.kanes_equations)
+    assert str(N2.mass_matrix) == str(N.mass_matrix)
+    for ke in N2.kanes_equations:
+        assert not ke.atoms(Symbol) & set(N2.symbol_dict_back)
+    # The unpickled dummy symbols are distinct from those of this run
+    assert len(N2.dummy_dict) == len(dummies)
+    assert not set(N2.dummy_dict) & set(dummies)
+    assert sorted([(str(k), str(v)) for k, v in N2.dummy_dict.items()]) == \
+            sorted([(str(k), str(v)) for k, v in dummies.items()])
+    assert _two_dof_system(2)[0].model_hash() != N.model_hash()
+    N2.eom_cache_version += 1
+    assert N2.model_hash() != N.model_hash()
+    assert N.model_hash(extra='lu') != N.model_hash()
+    # User assigned accelerations are part of the model
+    N3 = _two_dof_system()[0]
+    N3.O.children[0].abs_acc = Vector(0)
+    assert N3.model_hash() != N.model_hash()
+    N3 = _two_dof_system()[0]
+    N3.children[0].abs_ang_acc = Vector(0)
+    assert N3.model_hash() != N.model_hash()
+    # Pickles are only loaded from a private directory
+    os.chmod(d, 0777)
+    try:
+        N2.load_eoms(d)
+        assert False
+    except ValueError:
+        pass
+
+def test_common_subexpressions_gc():
+    N = NewtonianReferenceFrame('N')
+    (q1,), (q1d,) = N.declare_coords('q', 1)
+    a, b = symbols('a b')
+    temps, reduced = common_subexpressions([a*sin(q1) + q1d, b*sin(q1) +
+        q1d, q1*(a + b), q1*(a + b)**2])
+    assert [e for z, e in temps] == [a + b]
+    assert reduced[0] == a*sin(q1) + q1d
+
+def test_generate_function_cse():
+    from random import uniform
+    from pydy.functions import exec_source
+    x, y, z = symbols('x y z')
+    eq_lists = [[Eq(Symbol('a'), (x*y + z)**3 + x*y + z),
+                 Eq(Symbol('b'), (x*y + z)*(x - z))],
+                # cse() rewrites 1/y through y**2 as (y**2)**(-1/2)
+                [Eq(Symbol('a'), x/y), Eq(Symbol('b'), y**2*z),
+                 Eq(Symbol('c'), y**2*x + x/y), Eq(Symbol('d'), x*y**2)],
+                [Eq(Symbol('a'), z*(x + y)**(S(1)/2) + x*(x + y)**3),
+                 Eq(Symbol('b'), x*(x + y)**(S(1)/2) + z*(x + y)**3)]]
+    for eqs in eq_lists:
+        fs = generate_function('f', eqs, [x, y, z], cse=False)
+        assert "_cse" not in fs
+        f = exec_source(fs, 'f')
+        f_cse = exec_source(generate_function('f', eqs, [x, y, z], cse=True),
+                'f')
+        for i in range(20):
+            # Both signs, keeping x + y positive for the square roots
+            v = [uniform(0.5, 2.0), uniform(-0.4, 0.4), uniform(-2.0, 2.0)]
+            for a, b in zip(f(v), f_cse(v)):
+                assert abs(a - b) < 1e-12*max(1, abs(a))
+    assert "_cse" in generate_function('f', eq_lists[0], [x, y, z], cse=True)
+    # Not emitted when it doesn't lower the operation count
+    assert "_cse" not in generate_function('f', [Eq(Symbol('a'), x**2),
+        Eq(Symbol('b'), x/y + 1/y)], [x, y], cse=True)
 
 def test_mag():
     A = ReferenceFrame('A')
@@ -739,6 +1268,8 @@ def test_Point_get_point_list():
     assert P5.get_point_list(P3) == [P5, P3]
     assert P5.get_point_list(P4) == [P5, P3, P4]
     assert P5.get_point_list(P5) == [P5]
+    assert P4.get_point_path(P1) == (P4, P3, P2, N.O, P1)
+    assert P4.get_point_path(P1) is P4.get_point_path(P1)
 
 def test_point_rel():
     l1, l2, l3 = symbols('l1 l2 l3')
@@ -858,6 +1389,42 @@ def test_point_vel():
     assert CP.vel(P2, C) == P2.vel(CP, C)
     assert CP.vel(CP, C) == Vector(0)
 
+def test_point_abs_vel_acc():
+    N = NewtonianReferenceFrame('N')
+    q, qd = N.declare_coords('q', 2)
+    u, ud = N.declare_speeds('u', 2)
+    A = N.rotate('A', 3, q[0])
+    P = N.O.locate('P', q[1]*A[1])
+    Q = P.locate('Q', A[2], A)
+    assert P.abs_vel == P.vel(N.O, N)
+    assert Q.abs_vel == Q.vel(N.O, N)
+    assert Q.abs_vel is Q.vel()
+    assert Q.abs_acc == dt(Q.abs_vel, N)
+    # Assigning upstream replaces the computed values downstream
+    P.abs_vel = Vector(u[0]*A[1] + u[1]*A[2])
+    assert Q.abs_vel == P.abs_vel + Vector(-qd[0]*A[1])
+    assert Q.abs_acc == dt(P.abs_vel, N) + dt(Vector(-qd[0]*A[1]), N)
+    # Substitution keeps assigned values and recomputes the others
+    N.recursive_subs(N.O, {qd[0]: u[0]})
+    assert P.abs_vel == Vector(u[0]*A[1] + u[1]*A[2])
+    assert Q.abs_vel == P.abs_vel + Vector(-u[0]*A[1])
+
+def test_frame_abs_ang_vel_acc():
+    N = NewtonianReferenceFrame('N')
+    q, qd = N.declare_coords('q', 2)
+    u, ud = N.declare_speeds('u', 2)
+    A = N.rotate('A', 3, q[0])
+    B = A.rotate('B', 1, q[1])
+    assert B.abs_ang_vel == Vector(qd[0]*A[3] + qd[1]*B[1])
+    assert B.ang_vel() is B.abs_ang_vel
+    assert B.ang_acc() == dt(B.abs_ang_vel, N)
+    assert B.ang_acc(A) == Vector(qd[1].diff(Symbol('t'))*B[1])
+    A.abs_ang_vel = Vector(u[0]*A[3])
+    assert B.ang_vel(N) == Vector(u[0]*A[3] + qd[1]*B[1])
+    assert A.ang_acc() == Vector(ud[0]*A[3])
+    B.set_omega(Vector(u[1]*B[1]), A, force=True)
+    assert B.ang_vel() == Vector(u[0]*A[3] + u[1]*B[1])
+
 def test_Dyad_express():
     A = N.rotate('A', 1, q1)
     I = Symbol('I')
@@ -0,0 +1,68 @@
+from numpy import array, linspace, sin, cos, zeros
+from sympy import Symbol, Eq, symbols
+from pydy import generate_function
+from pydy.integrators import rk4, rk45, semi_implicit_euler
+
+def oscillator(x, t):
+    # Works for a single state and for a batch of states
+    return array([x[..., 1], -x[..., 0]]).T
+
+t = linspace(0, 2, 201)
+
+def test_rk4():
+    x = rk4(oscillator, [1., 0.], t)
+    assert x.shape == (201, 2)
+    assert (x[0] == [1., 0.]).all()
+    assert abs(x[-1, 0] - cos(2.)) < 1e-8
+    assert abs(x[-1, 1] + sin(2.)) < 1e-8
+
+def test_rk45():
+    x = rk45(oscillator, [1., 0.], t[::20], rtol=1e-10, atol=1e-12)
+    assert x.shape == (11, 2)
+    assert abs(x[-1, 0] - cos(2.)) < 1e-8
+    assert abs(x[-1, 1] + sin(2.)) < 1e-8
+
+def test_rk45_backward():
+    x = rk45(oscillator, [cos(2.), -sin(2.)], t[::-20], rtol=1e-10,
+            atol=1e-12)
+    assert abs(x[-1, 0] - 1.) < 1e-8
+    assert abs(x[-1, 1]) < 1e-8
+    try:
+        rk45(oscillator, [1., 0.], [0., 1., 0.5])
+        assert False
+    except ValueError:
+        pass
+
+def test_rk45_output_times():
+    # Shortening the steps to end at the output times doesn't shrink the
+    # following steps
+    calls = []
+    def f(x, t):
+        calls.append(t)
+        return oscillator(x, t)
+    rk45(f, [1., 0.], [0., 2.], h0=0.1)
+    n = len(calls)
+    del calls[:]
+    rk45(f, [1., 0.], [0., 1e-6, 2.], h0=0.1)
+    assert len(calls) <= n + 12
+
+def test_batch():
+    x0 = array([[1., 0.], [0., 1.], [2., 0.]])
+    for x in (rk4(oscillator, x0, t), rk45(oscillator, x0, t[::20])):
+        assert x.shape == (len(x), 3, 2)
+        assert abs(x[-1, 1, 0] - sin(2.)) < 1e-6
+        assert abs(x[-1, 2, 0] - 2*cos(2.)) < 1e-6
+
+def test_semi_implicit_euler():
+    x = semi_implicit_euler(oscillator, [1., 0.], linspace(0, 100, 10001), 1)
+    energy = (x**2).sum(axis=1)
+    assert abs(energy - 1).max() < 0.02
+
+def test_inplace():
+    q, u, k = symbols('q u k')
+    fs = generate_function('f', [Eq(Symbol('qd'), u), Eq(Symbol('ud'),
+        -k*q)], [q, u], [k], time=True, out=True, vectorized=True)
+    ns = {}
+    exec fs in ns
+    x = rk4(ns['f'], [[1., 0.], [0., 1.]], t, args=([1.],), inplace=True)
+    assert abs(x[-1, 0, 0] - cos(2.)) < 1e-8